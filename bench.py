@@ -0,0 +1,86 @@
+import os
+import random
+import string
+import subprocess
+import sys
+import time
+
+from main import SearchIndex
+
+QUERIES = ("main", "rdme", "cfgjs", "zzqx", "srcutil")
+
+
+def random_paths(count, seed=0):
+    rng = random.Random(seed)
+    words = [
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9)))
+        for _ in range(5000)
+    ]
+    extensions = ["py", "js", "md", "txt", "json", "rs", "c", "h", "log"]
+    return [
+        "/".join(rng.choices(words, k=rng.randint(1, 6))) + "." + rng.choice(extensions)
+        for _ in range(count)
+    ]
+
+
+def bench_search(count):
+    paths = random_paths(count)
+
+    start = time.perf_counter()
+    index = SearchIndex(paths)
+    build_time = time.perf_counter() - start
+    print(f"index {count} paths: {build_time * 1000:.0f} ms")
+
+    for query in QUERIES:
+        start = time.perf_counter()
+        candidates = index.candidates(query)
+        prefilter_time = time.perf_counter() - start
+        start = time.perf_counter()
+        matches = index.search(query)
+        search_time = time.perf_counter() - start
+        print(
+            f"{query!r:>10}: prefilter {prefilter_time * 1000:.1f} ms"
+            f" ({len(candidates)} candidates),"
+            f" search {search_time * 1000:.1f} ms ({len(matches)} matches)"
+        )
+
+
+def bench_import(runs=5):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    with open(script, encoding="utf-8") as f:
+        source = f.read()
+
+    start = time.perf_counter()
+    compile(source, script, "exec")
+    print(f"compile main.py: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import main"],
+            cwd=os.path.dirname(script),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        for line in result.stderr.splitlines():
+            self_us, cumulative_us, name = line.split("|")
+            if name.strip() == "main":
+                timings.append((int(self_us.split(":")[1]), int(cumulative_us)))
+    self_us, cumulative_us = min(timings)
+    print(
+        f"import main: self {self_us / 1000:.1f} ms, cumulative {cumulative_us / 1000:.1f} ms"
+    )
+
+    from main import NerdFontIcons
+
+    start = time.perf_counter()
+    NerdFontIcons.load_tables()
+    print(f"load icon tables: {(time.perf_counter() - start) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["import"]:
+        bench_import()
+    else:
+        bench_search(int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000)
@@ -1,26 +1,209 @@
+import argparse
+import bisect
+import collections
+import concurrent.futures
+import hashlib
+import heapq
+import json
+import mmap
+import multiprocessing
 import os
+import queue
 import re
+import select
 import shutil
+import signal
+import socket
+import shlex
+import socketserver
+import stat
 import string
+import subprocess
 import sys
+import tarfile
+import tempfile
 import termios
+import threading
+import time
 import tty
+import unicodedata
+import zipfile
+import zlib
+from multiprocessing import shared_memory
 from pathlib import Path
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-def memoize(func):
-    cache = {}
 
-    def wrapper(*args, **kwargs):
-        key = str(args) + str(kwargs)
-        if key not in cache:
-            cache[key] = func(*args, **kwargs)
-        return cache[key]
+class Cache:
+    # Every cache registers itself here so --profile can report on it
+    registry = {}
 
-    return wrapper
+    def __init__(
+        self,
+        name,
+        max_entries=None,
+        max_bytes=None,
+        ttl=None,
+        sizeof=None,
+        can_evict=None,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.can_evict = can_evict
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.RLock()
+        Cache.registry[name] = self
 
+    def __len__(self):
+        return len(self.entries)
 
-@memoize
+    def __contains__(self, key):
+        return self.get(key, Cache) is not Cache
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if (
+                entry is not None
+                and entry[2] is not None
+                and entry[2] <= time.monotonic()
+            ):
+                self.remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value) if self.sizeof else 0
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.remove(key)
+            self.entries[key] = (value, size, expires)
+            self.bytes += size
+            self.evict()
+        return value
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key, Cache)
+        if value is Cache:
+            value = self.put(key, compute())
+        return value
+
+    def over_limit(self, entries, size):
+        return (self.max_entries is not None and entries > self.max_entries) or (
+            self.max_bytes is not None and size > self.max_bytes
+        )
+
+    def evict(self, can_evict=None):
+        if not self.over_limit(len(self.entries), self.bytes):
+            return
+        can_evict = can_evict or self.can_evict
+        # Walk from the least recently used end and stop as soon as enough is
+        # freed; the newest entry always stays, the caller is about to use it
+        newest = next(reversed(self.entries))
+        entries = len(self.entries)
+        size = self.bytes
+        victims = []
+        for key, (value, entry_size, _) in self.entries.items():
+            if key == newest:
+                break
+            if can_evict is None or can_evict(key, value):
+                victims.append(key)
+                entries -= 1
+                size -= entry_size
+                if not self.over_limit(entries, size):
+                    break
+        for key in victims:
+            self.remove(key)
+            self.evictions += 1
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+        return entry
+
+    def invalidate(self, key):
+        with self.lock:
+            if self.remove(key) is not None:
+                self.invalidations += 1
+
+    def invalidate_where(self, predicate):
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                self.remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.bytes = 0
+
+    def items(self):
+        with self.lock:
+            return [(key, entry[0]) for key, entry in self.entries.items()]
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+def cached(cache):
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            key = (func.__name__, args, tuple(sorted(kwargs.items())))
+            return cache.get_or_compute(key, lambda: func(*args, **kwargs))
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+def print_cache_stats():
+    print(
+        f"{'cache':<16}{'entries':>9}{'bytes':>10}{'hits':>9}{'misses':>9}"
+        f"{'evicted':>9}{'invalid':>9}",
+        file=sys.stderr,
+    )
+    for name, cache in Cache.registry.items():
+        stats = cache.stats()
+        print(
+            f"{name:<16}{stats['entries']:>9}{human_size(stats['bytes']):>10}"
+            f"{stats['hits']:>9}{stats['misses']:>9}{stats['evictions']:>9}"
+            f"{stats['invalidations']:>9}",
+            file=sys.stderr,
+        )
+
+
+# Terminal geometry is re-read at most once a second and right away on SIGWINCH
+TERMINAL_CACHE = Cache("terminal", ttl=1.0)
+
+
+@cached(TERMINAL_CACHE)
 def get_terminal_height():
     try:
         return int(os.popen("tput lines", "r").read())
@@ -28,7 +211,7 @@ def get_terminal_height():
         return 24  # Default terminal height
 
 
-@memoize
+@cached(TERMINAL_CACHE)
 def get_terminal_width():
     try:
         return int(os.popen("tput columns", "r").read())
@@ -36,596 +219,550 @@ def get_terminal_width():
         return 24  # Default terminal height
 
 
+def human_size(size):
+    for unit in "BKMGT":
+        if size < 1024 or unit == "T":
+            break
+        size /= 1024
+    if unit == "B":
+        return f"{size}{unit}"
+    return f"{size:.1f}{unit}"
+
+
+ANSI_PATTERN = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]|\r")
+
+
+def char_width(char):
+    if unicodedata.combining(char):
+        return 0
+    if unicodedata.east_asian_width(char) in {"W", "F"}:
+        return 2
+    return 1
+
+
+def display_width(text):
+    return sum(char_width(char) for char in text)
+
+
+def clip_middle(text, width):
+    if display_width(text) <= width:
+        return text
+    if width <= 1:
+        return "…"[:width]
+    # Keep both ends of the name visible, the tail usually holds the extension
+    tail_budget = (width - 1) // 2
+    head_budget = width - 1 - tail_budget
+    head = []
+    for char in text:
+        head_budget -= char_width(char)
+        if head_budget < 0:
+            break
+        head.append(char)
+    tail = []
+    for char in reversed(text):
+        tail_budget -= char_width(char)
+        if tail_budget < 0:
+            break
+        tail.append(char)
+    return "".join(head) + "…" + "".join(reversed(tail))
+
+
+def disk_usage(stat):
+    # Count allocated blocks like du, falling back to the apparent size
+    blocks = getattr(stat, "st_blocks", None)
+    if blocks is None:
+        return stat.st_size
+    return blocks * 512
+
+
+def fuzzy_match(query, text):
+    if len(query) > len(text):
+        return False
+    remaining = iter(text.lower())
+    return all(char in remaining for char in query.lower())
+
+
+def fuzzy_score(query, text):
+    lowered = text.lower()
+    score = 0
+    position = 0
+    previous = -2
+    for char in query.lower():
+        index = lowered.find(char, position)
+        if index == -1:
+            return None
+        if index == previous + 1:
+            score += 8
+        if index == 0 or lowered[index - 1] in "/._- ":
+            score += 5
+        score -= index - position
+        previous = index
+        position = index + 1
+    return score * 1000 - len(text)
+
+
+def char_bit(char):
+    if "a" <= char <= "z":
+        return 1 << (ord(char) - 97)
+    if "0" <= char <= "9":
+        return 1 << (ord(char) - 22)
+    index = "._- /".find(char)
+    if index != -1:
+        return 1 << (36 + index)
+    return 1 << (41 + ord(char) % 23)
+
+
+def char_mask(text):
+    mask = 0
+    for char in set(text.lower()):
+        mask |= char_bit(char)
+    return mask
+
+
+class SearchIndex:
+    def __init__(self, texts):
+        self.texts = texts
+        masks = [char_mask(text) for text in texts]
+        lengths = [len(text) for text in texts]
+        if numpy is not None:
+            self.masks = numpy.array(masks, dtype=numpy.uint64)
+            self.lengths = numpy.array(lengths, dtype=numpy.uint32)
+        else:
+            self.masks = masks
+            self.lengths = lengths
+
+    def candidates(self, query):
+        # A text can only match if it contains every character of the query
+        # and is at least as long, which rules out most texts cheaply
+        query_mask = char_mask(query)
+        if numpy is not None:
+            query_mask = numpy.uint64(query_mask)
+            keep = (self.masks & query_mask) == query_mask
+            keep &= self.lengths >= len(query)
+            return numpy.flatnonzero(keep).tolist()
+        return [
+            index
+            for index, (mask, length) in enumerate(zip(self.masks, self.lengths))
+            if mask & query_mask == query_mask and length >= len(query)
+        ]
+
+    def search(self, query):
+        texts = self.texts
+        return [
+            index
+            for index in self.candidates(query)
+            if fuzzy_match(query, texts[index])
+        ]
+
+    def top(self, query, limit, offset=0, generation=None):
+        texts = self.texts
+        scored = []
+        for count, index in enumerate(self.candidates(query)):
+            if generation is not None and count % 4096 == 0:
+                if SEARCH_GENERATION.value != generation:
+                    return None
+            score = fuzzy_score(query, texts[index])
+            if score is not None:
+                scored.append((score, -(index + offset)))
+        return [
+            (score, -negated_index)
+            for score, negated_index in heapq.nlargest(limit, scored)
+        ]
+
+
+SHARDED_SEARCH_THRESHOLD = 200_000
+SEARCH_GENERATION = None
+SHARD_INDEXES = {}
+
+
+def init_search_worker(generation):
+    global SEARCH_GENERATION
+    SEARCH_GENERATION = generation
+
+
+def score_shard(name, size, offset, query, limit, generation):
+    if SEARCH_GENERATION.value != generation:
+        return None
+    index = SHARD_INDEXES.get(name)
+    if index is None:
+        shard = shared_memory.SharedMemory(name=name)
+        texts = bytes(shard.buf[:size]).decode("utf-8", "surrogateescape")
+        shard.close()
+        index = SHARD_INDEXES[name] = SearchIndex(texts.split("\0"))
+    return index.top(query, limit, offset, generation)
+
+
+class ShardedSearch:
+    def __init__(self, texts, shards=None, limit=100):
+        self.texts = texts
+        self.limit = limit
+        shards = shards or os.cpu_count() or 1
+        self.generation = multiprocessing.Value("i", 0)
+        self.shards = []
+        shard_length = -(-len(texts) // shards)
+        for offset in range(0, len(texts), shard_length):
+            data = "\0".join(texts[offset : offset + shard_length]).encode(
+                "utf-8", "surrogateescape"
+            )
+            shard = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+            shard.buf[: len(data)] = data
+            self.shards.append((shard, len(data), offset))
+        # One single-worker pool per shard, so every shard is always scored by
+        # the same process and its SearchIndex is built only once
+        self.pools = [
+            concurrent.futures.ProcessPoolExecutor(
+                max_workers=1,
+                initializer=init_search_worker,
+                initargs=(self.generation,),
+            )
+            for _ in self.shards
+        ]
+        self.futures = []
+        self.results = []
+
+    @property
+    def finished_shards(self):
+        return len(self.shards) - len(self.futures)
+
+    def submit(self, query):
+        # Bumping the generation makes workers abandon the stale query
+        self.cancel()
+        with self.generation.get_lock():
+            self.generation.value += 1
+        self.results = []
+        self.futures = [
+            pool.submit(
+                score_shard,
+                shard.name,
+                size,
+                offset,
+                query,
+                self.limit,
+                self.generation.value,
+            )
+            for pool, (shard, size, offset) in zip(self.pools, self.shards)
+        ]
+
+    def cancel(self):
+        for future in self.futures:
+            future.cancel()
+        self.futures = []
+
+    def poll(self, timeout=0):
+        done, _ = concurrent.futures.wait(self.futures, timeout=timeout)
+        for future in done:
+            self.futures.remove(future)
+            result = None if future.cancelled() else future.result()
+            if result:
+                self.results = heapq.nlargest(
+                    self.limit,
+                    self.results + result,
+                    key=lambda match: (match[0], -match[1]),
+                )
+        return self.results
+
+    def wait(self):
+        return self.poll(timeout=None)
+
+    def close(self):
+        self.cancel()
+        for pool in self.pools:
+            pool.shutdown(cancel_futures=True)
+        self.pools = []
+        for shard, _, _ in self.shards:
+            shard.close()
+            shard.unlink()
+        self.shards = []
+
+
 class NerdFontIcons:
 
-    ICON_MAPPING = {
-        "7z": "\u001b[31m\uf410\u001b[0m",
-        "a": "\u001b[35m\uf479\u001b[0m",
-        "ai": "\u001b[36m\ue7b4\u001b[0m",
-        "apk": "\u001b[32m\uf420\u001b[0m",
-        "asm": "\u001b[33m\uf471\u001b[0m",
-        "asp": "\u001b[34m\uf481\u001b[0m",
-        "aup": "\u001b[35m\uf473\u001b[0m",
-        "avi": "\u001b[36m\uf03d\u001b[0m",
-        "awk": "\u001b[33m\uf489\u001b[0m",
-        "bash": "\u001b[32m\ue795\u001b[0m",
-        "bat": "\u001b[31m\ue70f\u001b[0m",
-        "bmp": "\u001b[36m\uf1c5\u001b[0m",
-        "bz2": "\u001b[31m\uf410\u001b[0m",
-        "c": "\u001b[34m\ue61e\u001b[0m",
-        "c++": "\u001b[34m\ue61d\u001b[0m",
-        "cab": "\u001b[31m\ue70f\u001b[0m",
-        "cbr": "\u001b[33m\uf411\u001b[0m",
-        "cbz": "\u001b[33m\uf411\u001b[0m",
-        "cc": "\u001b[34m\ue61d\u001b[0m",
-        "class": "\u001b[32m\ue256\u001b[0m",
-        "clj": "\u001b[36m\ue768\u001b[0m",
-        "cljc": "\u001b[36m\ue768\u001b[0m",
-        "cljs": "\u001b[36m\ue76a\u001b[0m",
-        "cmake": "\u001b[31m\ue20b\u001b[0m",
-        "coffee": "\u001b[33m\ue751\u001b[0m",
-        "conf": "\u001b[35m\uf43c\u001b[0m",
-        "cp": "\u001b[32m\ue235\u001b[0m",
-        "cpio": "\u001b[31m\uf410\u001b[0m",
-        "cpp": "\u001b[34m\ue61d\u001b[0m",
-        "cs": "\u001b[32m\uf81a\u001b[0m",
-        "csh": "\u001b[32m\uf489\u001b[0m",
-        "css": "\u001b[34m\ue749\u001b[0m",
-        "cue": "\u001b[35m\uf001\u001b[0m",
-        "cvs": "\u001b[34m\ue702\u001b[0m",
-        "cxx": "\u001b[34m\ue61d\u001b[0m",
-        "d": "\u001b[31m\ue7af\u001b[0m",
-        "dart": "\u001b[36m\ue798\u001b[0m",
-        "db": "\u001b[35m\uf1c0\u001b[0m",
-        "deb": "\u001b[31m\uf420\u001b[0m",
-        "diff": "\u001b[33m\uf440\u001b[0m",
-        "dll": "\u001b[34m\uf481\u001b[0m",
-        "doc": "\u001b[34m\uf1c2\u001b[0m",
-        "docx": "\u001b[34m\uf1c2\u001b[0m",
-        "dump": "\u001b[31m\uf1c0\u001b[0m",
-        "edn": "\u001b[32m\ue72c\u001b[0m",
-        "eex": "\u001b[35m\ue62d\u001b[0m",
-        "efi": "\u001b[31m\uf1c0\u001b[0m",
-        "ejs": "\u001b[33m\ue618\u001b[0m",
-        "elf": "\u001b[31m\uf489\u001b[0m",
-        "elm": "\u001b[36m\ue62c\u001b[0m",
-        "epub": "\u001b[32m\ue28a\u001b[0m",
-        "erl": "\u001b[31m\ue7b1\u001b[0m",
-        "ex": "\u001b[35m\ue62d\u001b[0m",
-        "exe": "\u001b[31m\uf013\u001b[0m",
-        "exs": "\u001b[35m\ue62d\u001b[0m",
-        "f#": "\u001b[36m\ue7a7\u001b[0m",
-        "fifo": "\u001b[33m\uf43c\u001b[0m",
-        "fish": "\u001b[32m\uf489\u001b[0m",
-        "flac": "\u001b[35m\uf001\u001b[0m",
-        "flv": "\u001b[36m\uf03d\u001b[0m",
-        "fs": "\u001b[36m\ue7a7\u001b[0m",
-        "fsi": "\u001b[36m\ue7a7\u001b[0m",
-        "fsscript": "\u001b[36m\ue7a7\u001b[0m",
-        "fsx": "\u001b[36m\ue7a7\u001b[0m",
-        "gem": "\u001b[31m\ue23e\u001b[0m",
-        "gemspec": "\u001b[31m\ue23e\u001b[0m",
-        "gif": "\u001b[36m\uf1c5\u001b[0m",
-        "go": "\u001b[36m\ue626\u001b[0m",
-        "gz": "\u001b[31m\uf410\u001b[0m",
-        "gzip": "\u001b[31m\uf410\u001b[0m",
-        "h": "\u001b[35m\uf0fd\u001b[0m",
-        "haml": "\u001b[35m\uf15b\u001b[0m",
-        "hbs": "\u001b[33m\ue60f\u001b[0m",
-        "hh": "\u001b[35m\uf0fd\u001b[0m",
-        "hpp": "\u001b[35m\uf0fd\u001b[0m",
-        "hrl": "\u001b[35m\uf0fd\u001b[0m",
-        "hs": "\u001b[35m\ue777\u001b[0m",
-        "htaccess": "\u001b[33m\uf023\u001b[0m",
-        "htm": "\u001b[33m\uf13b\u001b[0m",
-        "html": "\u001b[33m\uf13b\u001b[0m",
-        "htpasswd": "\u001b[31m\uf023\u001b[0m",
-        "cfg": "\u001b[35m\uf43c\u001b[0m",
-        "hxx": "\u001b[35m\uf0fd\u001b[0m",
-        "ico": "\u001b[36m\uf1c5\u001b[0m",
-        "img": "\u001b[35m\uf1c0\u001b[0m",
-        "ini": "\u001b[35m\uf43c\u001b[0m",
-        "iso": "\u001b[35m\uf1c0\u001b[0m",
-        "jar": "\u001b[31m\ue204\u001b[0m",
-        "java": "\u001b[31m\ue204\u001b[0m",
-        "jl": "\u001b[35m\ue624\u001b[0m",
-        "jpeg": "\u001b[36m\uf1c5\u001b[0m",
-        "jpg": "\u001b[36m\uf1c5\u001b[0m",
-        "js": "\u001b[33m\ue74e\u001b[0m",
-        "json": "\u001b[33m\ue60b\u001b[0m",
-        "jsx": "\u001b[34m\ue7ba\u001b[0m",
-        "key": "\u001b[35m\uf023\u001b[0m",
-        "ksh": "\u001b[32m\uf489\u001b[0m",
-        "leex": "\u001b[35m\ue62d\u001b[0m",
-        "less": "\u001b[34m\ue758\u001b[0m",
-        "lha": "\u001b[31m\uf410\u001b[0m",
-        "lhs": "\u001b[35m\ue777\u001b[0m",
-        "log": "\u001b[33m\uf18d\u001b[0m",
-        "lua": "\u001b[36m\ue620\u001b[0m",
-        "lzh": "\u001b[31m\uf410\u001b[0m",
-        "lzma": "\u001b[31m\uf410\u001b[0m",
-        "m4a": "\u001b[35m\uf001\u001b[0m",
-        "m4v": "\u001b[36m\uf03d\u001b[0m",
-        "markdown": "\u001b[34m\ue609\u001b[0m",
-        "md": "\u001b[34m\ue609\u001b[0m",
-        "mdx": "\u001b[34m\ue609\u001b[0m",
-        "mjs": "\u001b[33m\ue74e\u001b[0m",
-        "mkv": "\u001b[36m\uf03d\u001b[0m",
-        "ml": "\u001b[33mλ\u001b[0m",
-        "mli": "\u001b[33mλ\u001b[0m",
-        "mov": "\u001b[36m\uf03d\u001b[0m",
-        "mp3": "\u001b[35m\uf001\u001b[0m",
-        "mp4": "\u001b[36m\uf03d\u001b[0m",
-        "mpeg": "\u001b[36m\uf03d\u001b[0m",
-        "mpg": "\u001b[36m\uf03d\u001b[0m",
-        "msi": "\u001b[35m\uf1c4\u001b[0m",
-        "mustache": "\u001b[33m\ue60f\u001b[0m",
-        "nix": "\u001b[36m\uf313\u001b[0m",
-        "o": "\u001b[31m\uf471\u001b[0m",
-        "ogg": "\u001b[35m\uf001\u001b[0m",
-        "part": "\u001b[35m\uf1c0\u001b[0m",
-        "pdf": "\u001b[31m\uf1c1\u001b[0m",
-        "php": "\u001b[35m\ue73d\u001b[0m",
-        "pl": "\u001b[36m\ue769\u001b[0m",
-        "pm": "\u001b[36m\ue769\u001b[0m",
-        "png": "\u001b[36m\uf1c5\u001b[0m",
-        "pp": "\u001b[35m\ue7a8\u001b[0m",
-        "ppt": "\u001b[33m\uf1c4\u001b[0m",
-        "pptx": "\u001b[33m\uf1c4\u001b[0m",
-        "ps1": "\u001b[36m\uf489\u001b[0m",
-        "psb": "\u001b[34m\ue7aa\u001b[0m",
-        "psd": "\u001b[34m\ue7aa\u001b[0m",
-        "pub": "\u001b[31m\uf1c1\u001b[0m",
-        "py": "\u001b[33m\ue235\u001b[0m",
-        "pyc": "\u001b[33m\ue235\u001b[0m",
-        "pyd": "\u001b[33m\ue235\u001b[0m",
-        "pyo": "\u001b[33m\ue235\u001b[0m",
-        "r": "\u001b[34m\uf25d\u001b[0m",
-        "rake": "\u001b[31m\ue21e\u001b[0m",
-        "rar": "\u001b[31m\uf410\u001b[0m",
-        "rb": "\u001b[31m\ue21e\u001b[0m",
-        "rc": "\u001b[31m\uf43c\u001b[0m",
-        "rlib": "\u001b[33m\ue7a8\u001b[0m",
-        "rmd": "\u001b[34m\uf25d\u001b[0m",
-        "rom": "\u001b[35m\uf1c0\u001b[0m",
-        "rpm": "\u001b[31m\uf420\u001b[0m",
-        "rproj": "\u001b[34m\ue7a7\u001b[0m",
-        "rs": "\u001b[38;5;208m\ue7a8\u001b[0m",
-        "rss": "\u001b[33m\uf09e\u001b[0m",
-        "rtf": "\u001b[34m\uf1c2\u001b[0m",
-        "s": "\u001b[31m\uf471\u001b[0m",
-        "sass": "\u001b[35m\ue603\u001b[0m",
-        "scala": "\u001b[31m\ue737\u001b[0m",
-        "scss": "\u001b[35m\ue749\u001b[0m",
-        "sh": "\u001b[32m\uf489\u001b[0m",
-        "slim": "\u001b[33m\ue73b\u001b[0m",
-        "sln": "\u001b[35m\ue70c\u001b[0m",
-        "so": "\u001b[31m\uf471\u001b[0m",
-        "sql": "\u001b[34m\uf1c0\u001b[0m",
-        "styl": "\u001b[32m\ue600\u001b[0m",
-        "suo": "\u001b[34m\ue70c\u001b[0m",
-        "swift": "\u001b[33m\ue755\u001b[0m",
-        "t": "\u001b[32m\ue769\u001b[0m",
-        "tar": "\u001b[31m\uf410\u001b[0m",
-        "tex": "\u001b[32m\uf034\u001b[0m",
-        "tgz": "\u001b[31m\uf410\u001b[0m",
-        "toml": "\u001b[38;5;250m\ue615\u001b[0m",
-        "torrent": "\u001b[31m\uf481\u001b[0m",
-        "ts": "\u001b[34m\ue628\u001b[0m",
-        "tsx": "\u001b[34m\ue7ba\u001b[0m",
-        "twig": "\u001b[32m\ue61c\u001b[0m",
-        "vim": "\u001b[32m\ue62b\u001b[0m",
-        "vimrc": "\u001b[32m\ue62b\u001b[0m",
-        "vue": "\u001b[32m\ufd42\u001b[0m",
-        "wav": "\u001b[35m\uf001\u001b[0m",
-        "webm": "\u001b[36m\uf03d\u001b[0m",
-        "webmanifest": "\u001b[32m\uf489\u001b[0m",
-        "webp": "\u001b[36m\uf1c5\u001b[0m",
-        "xbps": "\u001b[31m\uf420\u001b[0m",
-        "xcplayground": "\u001b[33m\ue755\u001b[0m",
-        "xhtml": "\u001b[33m\uf13b\u001b[0m",
-        "xls": "\u001b[32m\uf1c3\u001b[0m",
-        "xlsx": "\u001b[32m\uf1c3\u001b[0m",
-        "xml": "\u001b[33m\uf72d\u001b[0m",
-        "xul": "\u001b[33m\uf72d\u001b[0m",
-        "xz": "\u001b[31m\uf410\u001b[0m",
-        "yaml": "\u001b[33m\uf481\u001b[0m",
-        "yml": "\u001b[33m\uf481\u001b[0m",
-        "zip": "\u001b[31m\uf410\u001b[0m",
-        "zsh": "\u001b[32m\uf489\u001b[0m",
-    }
-
-    ICON_MAPPING_COLORLESS = {
-        "7z": "",
-        "a": "",
-        "ai": "",
-        "apk": "",
-        "asm": "",
-        "asp": "",
-        "aup": "",
-        "avi": "",
-        "awk": "",
-        "bash": "",
-        "bat": "",
-        "bmp": "",
-        "bz2": "",
-        "c": "",
-        "c++": "",
-        "cab": "",
-        "cbr": "",
-        "cbz": "",
-        "cc": "",
-        "class": "",
-        "clj": "",
-        "cljc": "",
-        "cljs": "",
-        "cmake": "",
-        "coffee": "",
-        "conf": "",
-        "cp": "",
-        "cpio": "",
-        "cpp": "",
-        "cs": "",
-        "csh": "",
-        "css": "",
-        "cue": "",
-        "cvs": "",
-        "cxx": "",
-        "d": "",
-        "dart": "",
-        "db": "",
-        "deb": "",
-        "diff": "",
-        "dll": "",
-        "doc": "",
-        "docx": "",
-        "dump": "",
-        "edn": "",
-        "eex": "",
-        "efi": "",
-        "ejs": "",
-        "elf": "",
-        "elm": "",
-        "epub": "",
-        "erl": "",
-        "ex": "",
-        "exe": "",
-        "exs": "",
-        "f#": "",
-        "fifo": "ﳣ",
-        "fish": "",
-        "flac": "",
-        "flv": "",
-        "fs": "",
-        "fsi": "",
-        "fsscript": "",
-        "fsx": "",
-        "gem": "",
-        "gemspec": "",
-        "gif": "",
-        "go": "",
-        "gz": "",
-        "gzip": "",
-        "h": "",
-        "haml": "",
-        "hbs": "",
-        "hh": "",
-        "hpp": "",
-        "hrl": "",
-        "hs": "",
-        "htaccess": "",
-        "htm": "",
-        "html": "",
-        "htpasswd": "",
-        "cfg": "",
-        "hxx": "",
-        "ico": "",
-        "img": "",
-        "ini": "",
-        "iso": "",
-        "jar": "",
-        "java": "",
-        "jl": "",
-        "jpeg": "",
-        "jpg": "",
-        "js": "",
-        "json": "",
-        "jsx": "",
-        "key": "",
-        "ksh": "",
-        "leex": "",
-        "less": "",
-        "lha": "",
-        "lhs": "",
-        "log": "",
-        "lua": "",
-        "lzh": "",
-        "lzma": "",
-        "m4a": "",
-        "m4v": "",
-        "markdown": "",
-        "md": "",
-        "mdx": "",
-        "mjs": "",
-        "mkv": "",
-        "ml": "λ",
-        "mli": "λ",
-        "mov": "",
-        "mp3": "",
-        "mp4": "",
-        "mpeg": "",
-        "mpg": "",
-        "msi": "",
-        "mustache": "",
-        "nix": "",
-        "o": "",
-        "ogg": "",
-        "part": "",
-        "pdf": "",
-        "php": "",
-        "pl": "",
-        "pm": "",
-        "png": "",
-        "pp": "",
-        "ppt": "",
-        "pptx": "",
-        "ps1": "",
-        "psb": "",
-        "psd": "",
-        "pub": "",
-        "py": "",
-        "pyc": "",
-        "pyd": "",
-        "pyo": "",
-        "r": "ﳒ",
-        "rake": "",
-        "rar": "",
-        "rb": "",
-        "rc": "",
-        "rlib": "",
-        "rmd": "",
-        "rom": "",
-        "rpm": "",
-        "rproj": "鉶",
-        "rs": "",
-        "rss": "",
-        "rtf": "",
-        "s": "",
-        "sass": "",
-        "scala": "",
-        "scss": "",
-        "sh": "",
-        "slim": "",
-        "sln": "",
-        "so": "",
-        "sql": "",
-        "styl": "",
-        "suo": "",
-        "swift": "",
-        "t": "",
-        "tar": "",
-        "tex": "ﭨ",
-        "tgz": "",
-        "toml": "",
-        "torrent": "",
-        "ts": "",
-        "tsx": "",
-        "twig": "",
-        "vim": "",
-        "vimrc": "",
-        "vue": "﵂",
-        "wav": "",
-        "webm": "",
-        "webmanifest": "",
-        "webp": "",
-        "xbps": "",
-        "xcplayground": "",
-        "xhtml": "",
-        "xls": "",
-        "xlsx": "",
-        "xml": "",
-        "xul": "",
-        "xz": "",
-        "yaml": "",
-        "yml": "",
-        "zip": "",
-        "zsh": "",
-    }
-
-    FILE_NODE_EXACT_MATCHES = {
-        ".bash_aliases": "\u001b[32m\uf489\u001b[0m",
-        ".bash_history": "\u001b[32m\uf489\u001b[0m",
-        ".bash_logout": "\u001b[32m\uf489\u001b[0m",
-        ".bash_profile": "\u001b[32m\uf489\u001b[0m",
-        ".bashprofile": "\u001b[32m\uf489\u001b[0m",
-        ".bashrc": "\u001b[32m\uf489\u001b[0m",
-        ".dmrc": "\u001b[33m\uf43c\u001b[0m",
-        ".DS_Store": "\u001b[35m\uf43c\u001b[0m",
-        ".fasd": "\u001b[35m\uf43c\u001b[0m",
-        ".fehbg": "\u001b[35m\uf43c\u001b[0m",
-        ".gitattributes": "\u001b[31m\uf1d3\u001b[0m",
-        ".gitconfig": "\u001b[31m\uf1d3\u001b[0m",
-        ".gitignore": "\u001b[31m\uf1d3\u001b[0m",
-        ".gitlab-ci.yml": "\u001b[33m\uf7d2\u001b[0m",
-        ".gvimrc": "\u001b[32m\uf43c\u001b[0m",
-        ".inputrc": "\u001b[35m\uf43c\u001b[0m",
-        ".jack-settings": "\u001b[35m\uf43c\u001b[0m",
-        ".mime.types": "\u001b[35m\uf43c\u001b[0m",
-        ".ncmpcpp": "\u001b[35m\uf43c\u001b[0m",
-        ".nvidia-settings-rc": "\u001b[35m\uf43c\u001b[0m",
-        ".pam_environment": "\u001b[35m\uf43c\u001b[0m",
-        ".profile": "\u001b[35m\uf43c\u001b[0m",
-        ".recently-used": "\u001b[35m\uf43c\u001b[0m",
-        ".selected_editor": "\u001b[35m\uf43c\u001b[0m",
-        ".vim": "\u001b[32m\ue62b\u001b[0m",
-        ".viminfo": "\u001b[32m\ue62b\u001b[0m",
-        ".vimrc": "\u001b[32m\ue62b\u001b[0m",
-        ".Xauthority": "\u001b[35m\uf43c\u001b[0m",
-        ".Xdefaults": "\u001b[35m\uf43c\u001b[0m",
-        ".xinitrc": "\u001b[35m\uf43c\u001b[0m",
-        ".xinputrc": "\u001b[35m\uf43c\u001b[0m",
-        ".Xresources": "\u001b[35m\uf43c\u001b[0m",
-        ".zshrc": "\u001b[32m\uf489\u001b[0m",
-        "_gvimrc": "\u001b[32m\ue62b\u001b[0m",
-        "_vimrc": "\u001b[32m\ue62b\u001b[0m",
-        "a.out": "\u001b[31m\uf471\u001b[0m",
-        "authorized_keys": "\u001b[35m\uf43c\u001b[0m",
-        "bspwmrc": "\u001b[35m\uf43c\u001b[0m",
-        "cmakelists.txt": "\u001b[31m\ue20b\u001b[0m",
-        "config": "\u001b[35m\uf43c\u001b[0m",
-        "config.ac": "\u001b[35m\uf43c\u001b[0m",
-        "config.m4": "\u001b[35m\uf43c\u001b[0m",
-        "config.mk": "\u001b[35m\uf43c\u001b[0m",
-        "config.ru": "\u001b[31m\ue21e\u001b[0m",
-        "configure": "\u001b[35m\uf43c\u001b[0m",
-        "docker-compose.yml": "\u001b[36m\uf308\u001b[0m",
-        "dockerfile": "\u001b[36m\uf308\u001b[0m",
-        "Dockerfile": "\u001b[36m\uf308\u001b[0m",
-        "dropbox": "\u001b[34m\uf16b\u001b[0m",
-        "exact-match-case-sensitive-1.txt": "\u001b[35mX1\u001b[0m",
-        "exact-match-case-sensitive-2": "\u001b[35mX2\u001b[0m",
-        "favicon.ico": "\u001b[32m\ue623\u001b[0m",
-        "gemfile": "\u001b[31m\ue21e\u001b[0m",
-        "gruntfile.coffee": "\u001b[33m\ue611\u001b[0m",
-        "gruntfile.js": "\u001b[33m\ue611\u001b[0m",
-        "gruntfile.ls": "\u001b[33m\ue611\u001b[0m",
-        "gulpfile.coffee": "\u001b[31m\ue610\u001b[0m",
-        "gulpfile.js": "\u001b[31m\ue610\u001b[0m",
-        "gulpfile.ls": "\u001b[31m\ue610\u001b[0m",
-        "ini": "\u001b[35m\uf43c\u001b[0m",
-        "known_hosts": "\u001b[35m\uf43c\u001b[0m",
-        "ledger": "\u001b[35m\uf43c\u001b[0m",
-        "license": "\u001b[33m\uf2c2\u001b[0m",
-        "LICENSE": "\u001b[33m\uf2c2\u001b[0m",
-        "LICENSE.md": "\u001b[33m\uf2c2\u001b[0m",
-        "LICENSE.txt": "\u001b[33m\uf2c2\u001b[0m",
-        "Makefile": "\u001b[35m\uf489\u001b[0m",
-        "makefile": "\u001b[35m\uf489\u001b[0m",
-        "Makefile.ac": "\u001b[35m\uf489\u001b[0m",
-        "Makefile.in": "\u001b[35m\uf489\u001b[0m",
-        "mimeapps.list": "\u001b[35m\uf43c\u001b[0m",
-        "mix.lock": "\u001b[35m\uf43c\u001b[0m",
-        "node_modules": "\u001b[35m\uf43c\u001b[0m",
-        "package-lock.json": "\u001b[33m\ue718\u001b[0m",
-        "package.json": "\u001b[33m\ue718\u001b[0m",
-        "playlists": "\u001b[35m\uf43c\u001b[0m",
-        "procfile": "\u001b[35m\uf43c\u001b[0m",
-        "Rakefile": "\u001b[31m\ue21e\u001b[0m",
-        "rakefile": "\u001b[31m\ue21e\u001b[0m",
-        "react.jsx": "\u001b[34m\ue7ba\u001b[0m",
-        "README": "\u001b[33m\uf48d\u001b[0m",
-        "README.markdown": "\u001b[33m\uf48d\u001b[0m",
-        "README.md": "\u001b[33m\uf48d\u001b[0m",
-        "README.rst": "\u001b[33m\uf48d\u001b[0m",
-        "README.txt": "\u001b[33m\uf48d\u001b[0m",
-        "sxhkdrc": "\u001b[35m\uf43c\u001b[0m",
-        "user-dirs.dirs": "\u001b[35m\uf43c\u001b[0m",
-        "webpack.config.js": "\u001b[33m\ue61f\u001b[0m",
-    }
-
-    FILE_NODE_EXACT_MATCHES_COLORLESS = {
-        ".bash_aliases": "",
-        ".bash_history": "",
-        ".bash_logout": "",
-        ".bash_profile": "",
-        ".bashprofile": "",
-        ".bashrc": "",
-        ".dmrc": "",
-        ".DS_Store": "",
-        ".fasd": "",
-        ".fehbg": "",
-        ".gitattributes": "",
-        ".gitconfig": "",
-        ".gitignore": "",
-        ".gitlab-ci.yml": "",
-        ".gvimrc": "",
-        ".inputrc": "",
-        ".jack-settings": "",
-        ".mime.types": "",
-        ".ncmpcpp": "",
-        ".nvidia-settings-rc": "",
-        ".pam_environment": "",
-        ".profile": "",
-        ".recently-used": "",
-        ".selected_editor": "",
-        ".vim": "",
-        ".viminfo": "",
-        ".vimrc": "",
-        ".Xauthority": "",
-        ".Xdefaults": "",
-        ".xinitrc": "",
-        ".xinputrc": "",
-        ".Xresources": "",
-        ".zshrc": "",
-        "_gvimrc": "",
-        "_vimrc": "",
-        "a.out": "",
-        "authorized_keys": "",
-        "bspwmrc": "",
-        "cmakelists.txt": "",
-        "config": "",
-        "config.ac": "",
-        "config.m4": "",
-        "config.mk": "",
-        "config.ru": "",
-        "configure": "",
-        "docker-compose.yml": "",
-        "dockerfile": "",
-        "Dockerfile": "",
-        "dropbox": "",
-        "exact-match-case-sensitive-1.txt": "X1",
-        "exact-match-case-sensitive-2": "X2",
-        "favicon.ico": "",
-        "gemfile": "",
-        "gruntfile.coffee": "",
-        "gruntfile.js": "",
-        "gruntfile.ls": "",
-        "gulpfile.coffee": "",
-        "gulpfile.js": "",
-        "gulpfile.ls": "",
-        "ini": "",
-        "known_hosts": "",
-        "ledger": "",
-        "license": "",
-        "LICENSE": "",
-        "LICENSE.md": "",
-        "LICENSE.txt": "",
-        "Makefile": "",
-        "makefile": "",
-        "Makefile.ac": "",
-        "Makefile.in": "",
-        "mimeapps.list": "",
-        "mix.lock": "",
-        "node_modules": "",
-        "package-lock.json": "",
-        "package.json": "",
-        "playlists": "",
-        "procfile": "",
-        "Rakefile": "",
-        "rakefile": "",
-        "react.jsx": "",
-        "README": "",
-        "README.markdown": "",
-        "README.md": "",
-        "README.rst": "",
-        "README.txt": "",
-        "sxhkdrc": "",
-        "user-dirs.dirs": "",
-        "webpack.config.js": "",
-    }
+    ICON_SPEC = """
+        31=\uf410 7z bz2 cpio gz gzip lha lzh lzma rar tar tgz xz zip
+        35=\uf479 a
+        36=\ue7b4 ai
+        32=\uf420 apk
+        33=\uf471 asm
+        34=\uf481 asp dll
+        35=\uf473 aup
+        36=\uf03d avi flv m4v mkv mov mp4 mpeg mpg webm
+        33=\uf489 awk
+        32=\ue795 bash
+        31=\ue70f bat cab
+        36=\uf1c5 bmp gif ico jpeg jpg png webp
+        34=\ue61e c
+        34=\ue61d c++ cc cpp cxx
+        33=\uf411 cbr cbz
+        32=\ue256 class
+        36=\ue768 clj cljc
+        36=\ue76a cljs
+        31=\ue20b cmake
+        33=\ue751 coffee
+        35=\uf43c conf cfg ini
+        32=\ue235 cp
+        32=\uf81a cs
+        32=\uf489 csh fish ksh sh webmanifest zsh
+        34=\ue749 css
+        35=\uf001 cue flac m4a mp3 ogg wav
+        34=\ue702 cvs
+        31=\ue7af d
+        36=\ue798 dart
+        35=\uf1c0 db img iso part rom
+        31=\uf420 deb rpm xbps
+        33=\uf440 diff
+        34=\uf1c2 doc docx rtf
+        31=\uf1c0 dump efi
+        32=\ue72c edn
+        35=\ue62d eex ex exs leex
+        33=\ue618 ejs
+        31=\uf489 elf
+        36=\ue62c elm
+        32=\ue28a epub
+        31=\ue7b1 erl
+        31=\uf013 exe
+        36=\ue7a7 f# fs fsi fsscript fsx
+        33=\uf43c fifo
+        31=\ue23e gem gemspec
+        36=\ue626 go
+        35=\uf0fd h hh hpp hrl hxx
+        35=\uf15b haml
+        33=\ue60f hbs mustache
+        35=\ue777 hs lhs
+        33=\uf023 htaccess
+        33=\uf13b htm html xhtml
+        31=\uf023 htpasswd
+        31=\ue204 jar java
+        35=\ue624 jl
+        33=\ue74e js mjs
+        33=\ue60b json
+        34=\ue7ba jsx tsx
+        35=\uf023 key
+        34=\ue758 less
+        33=\uf18d log
+        36=\ue620 lua
+        34=\ue609 markdown md mdx
+        33=\u03bb ml mli
+        35=\uf1c4 msi
+        36=\uf313 nix
+        31=\uf471 o s so
+        31=\uf1c1 pdf pub
+        35=\ue73d php
+        36=\ue769 pl pm
+        35=\ue7a8 pp
+        33=\uf1c4 ppt pptx
+        36=\uf489 ps1
+        34=\ue7aa psb psd
+        33=\ue235 py pyc pyd pyo
+        34=\uf25d r rmd
+        31=\ue21e rake rb
+        31=\uf43c rc
+        33=\ue7a8 rlib
+        34=\ue7a7 rproj
+        38;5;208=\ue7a8 rs
+        33=\uf09e rss
+        35=\ue603 sass
+        31=\ue737 scala
+        35=\ue749 scss
+        33=\ue73b slim
+        35=\ue70c sln
+        34=\uf1c0 sql
+        32=\ue600 styl
+        34=\ue70c suo
+        33=\ue755 swift xcplayground
+        32=\ue769 t
+        32=\uf034 tex
+        38;5;250=\ue615 toml
+        31=\uf481 torrent
+        34=\ue628 ts
+        32=\ue61c twig
+        32=\ue62b vim vimrc
+        32=\ufd42 vue
+        32=\uf1c3 xls xlsx
+        33=\uf72d xml xul
+        33=\uf481 yaml yml
+    """
+
+    ICON_SPEC_COLORLESS = """
+        =\uf187 7z apk bz2 cab cpio deb gem gz gzip lha lzh lzma rar rpm tar tgz xbps xz
+            zip
+        =\ue624 a cmake jl o so
+        =\ue7b4 ai
+        =\ue614 asm css less s
+        =\ue795 asp awk bash csh efi elf fish ksh ps1 rom sh zsh
+        =\uf001 aup cue flac m4a mp3 ogg wav
+        =\uf008 avi flv m4v mkv mov mp4 mpeg mpg webm
+        =\ue615 bat conf cvs htaccess htpasswd cfg ini rc toml yaml yml
+        =\ue60d bmp gif ico jpeg jpg png webp
+        =\ue61e c h
+        =\ue61d c++ cc cp cpp cxx hpp
+        =\uf075 cbr cbz
+        =\ue738 class jar java
+        =\ue768 clj cljc
+        =\ue76a cljs edn
+        =\ue61b coffee
+        =\uf81a cs
+        =\ue7af d
+        =\ue798 dart
+        =\ue706 db dump img iso sql
+        =\ue728 diff
+        =\ue70f dll exe msi
+        =\uf02d doc docx epub rtf
+        =\ue62d eex ex exs leex
+        =\ue60e ejs haml htm html slim xhtml xml
+        =\ue62c elm
+        =\ue7b1 erl hrl
+        =\ue7a7 f# fs fsi fsscript fsx
+        =\ufce3 fifo
+        =\ue791 gemspec rake rb
+        =\ue627 go
+        =\ue60f hbs mustache
+        =\uf0fd hh hxx
+        =\ue61f hs lhs
+        =\ue60c js mjs
+        =\ue60b json webmanifest
+        =\ue7ba jsx tsx
+        =\ue60a key pub
+        =\uf1ea log
+        =\ue620 lua
+        =\ue609 markdown md mdx rmd
+        =\u03bb ml mli
+        =\uf313 nix
+        =\ue384 part
+        =\uf724 pdf
+        =\ue608 php
+        =\ue769 pl pm t
+        =\uf499 pp
+        =\uf726 ppt pptx
+        =\ue7b8 psb psd
+        =\ue606 py pyc pyd pyo
+        =\ufcd2 r
+        =\ue7a8 rlib rs
+        =\ufac5 rproj
+        =\ue619 rss
+        =\ue603 sass scss
+        =\ue737 scala
+        =\ue70c sln suo
+        =\ue600 styl
+        =\ue755 swift xcplayground
+        =\ufb68 tex
+        =\ue371 torrent
+        =\ue628 ts
+        =\ue61c twig
+        =\ue7c5 vim vimrc
+        =\ufd42 vue
+        =\uf71a xls xlsx
+        =\ue745 xul
+    """
+
+    EXACT_MATCH_SPEC = """
+        32=\uf489 .bash_aliases .bash_history .bash_logout .bash_profile .bashprofile
+            .bashrc .zshrc
+        33=\uf43c .dmrc
+        35=\uf43c .DS_Store .fasd .fehbg .inputrc .jack-settings .mime.types .ncmpcpp
+            .nvidia-settings-rc .pam_environment .profile .recently-used
+            .selected_editor .Xauthority .Xdefaults .xinitrc .xinputrc .Xresources
+            authorized_keys bspwmrc config config.ac config.m4 config.mk configure ini
+            known_hosts ledger mimeapps.list mix.lock node_modules playlists procfile
+            sxhkdrc user-dirs.dirs
+        31=\uf1d3 .gitattributes .gitconfig .gitignore
+        33=\uf7d2 .gitlab-ci.yml
+        32=\uf43c .gvimrc
+        32=\ue62b .vim .viminfo .vimrc _gvimrc _vimrc
+        31=\uf471 a.out
+        31=\ue20b cmakelists.txt
+        31=\ue21e config.ru gemfile Rakefile rakefile
+        36=\uf308 docker-compose.yml dockerfile Dockerfile
+        34=\uf16b dropbox
+        35=X1 exact-match-case-sensitive-1.txt
+        35=X2 exact-match-case-sensitive-2
+        32=\ue623 favicon.ico
+        33=\ue611 gruntfile.coffee gruntfile.js gruntfile.ls
+        31=\ue610 gulpfile.coffee gulpfile.js gulpfile.ls
+        33=\uf2c2 license LICENSE LICENSE.md LICENSE.txt
+        35=\uf489 Makefile makefile Makefile.ac Makefile.in
+        33=\ue718 package-lock.json package.json
+        34=\ue7ba react.jsx
+        33=\uf48d README README.markdown README.md README.rst README.txt
+        33=\ue61f webpack.config.js
+    """
+
+    EXACT_MATCH_SPEC_COLORLESS = """
+        =\ue615 .bash_aliases .bash_history .bash_logout .bash_profile .bashprofile
+            .bashrc .dmrc .DS_Store .fasd .gitattributes .gitconfig .gitignore .inputrc
+            .jack-settings .mime.types .nvidia-settings-rc .pam_environment .profile
+            .recently-used .selected_editor .Xauthority .Xdefaults .xinitrc .xinputrc
+            .Xresources .zshrc bspwmrc cmakelists.txt config ini Makefile makefile
+            Makefile.ac Makefile.in mimeapps.list sxhkdrc user-dirs.dirs
+        =\ue244 .fehbg
+        =\uf296 .gitlab-ci.yml
+        =\ue62b .gvimrc _gvimrc _vimrc
+        =\uf001 .ncmpcpp playlists
+        =\ue7c5 .vim .viminfo .vimrc
+        =\ue795 a.out configure
+        =\ue60a authorized_keys known_hosts license LICENSE LICENSE.md LICENSE.txt
+        =\ue624 config.ac config.m4 config.mk
+        =\ue791 config.ru gemfile Rakefile rakefile
+        =\uf308 docker-compose.yml Dockerfile
+        =\ue7b0 dockerfile
+        =\ue707 dropbox
+        =X1 exact-match-case-sensitive-1.txt
+        =X2 exact-match-case-sensitive-2
+        =\ue623 favicon.ico
+        =\ue611 gruntfile.coffee gruntfile.js gruntfile.ls
+        =\ue610 gulpfile.coffee gulpfile.js gulpfile.ls
+        =\uf155 ledger
+        =\ue62d mix.lock
+        =\ue718 node_modules package-lock.json package.json webpack.config.js
+        =\ue607 procfile
+        =\ue625 react.jsx
+        =\ue609 README README.markdown README.md README.rst README.txt
+    """
+
+    colored = "NO_COLOR" not in os.environ
+    tables = None
+    resolved = {}
+
+    @staticmethod
+    def parse_spec(spec):
+        table = {}
+        icon = None
+        for token in spec.split():
+            if "=" in token:
+                sgr, glyph = token.split("=")
+                icon = f" \u001b[{sgr}m{glyph}\u001b[0m " if sgr else f" {glyph} "
+            else:
+                table[token] = icon
+        return table
+
+    @classmethod
+    def load_tables(cls):
+        if cls.colored:
+            specs = (cls.EXACT_MATCH_SPEC, cls.ICON_SPEC)
+        else:
+            specs = (cls.EXACT_MATCH_SPEC_COLORLESS, cls.ICON_SPEC_COLORLESS)
+        cls.tables = tuple(cls.parse_spec(spec) for spec in specs)
+        cls.resolved = {}
+        return cls.tables
 
     @classmethod
-    def get_icon(cls, file_name):
-        if file_name:
-            if os.path.isdir(file_name) or file_name[-1] == "/":
-                return "\u001b[34m  "
+    def get_icon(cls, file_name, is_dir=None):
+        if is_dir is None and file_name:
+            is_dir = file_name[-1] == "/" or os.path.isdir(file_name)
+        if is_dir:
+            return "\u001b[34m \uf115 " if cls.colored else " \uf115 "
 
-        extension = file_name[file_name.rfind(".") :]
-        result = cls.FILE_NODE_EXACT_MATCHES.get(os.path.basename(file_name), None)
-        if not result:
-            result = cls.ICON_MAPPING.get(extension[1:].lower(), "\uF016")
+        exact_matches, extensions = cls.tables or cls.load_tables()
+        result = exact_matches.get(os.path.basename(file_name))
+        if result:
+            return result
 
-        return " " + result + " "
+        dot = file_name.rfind(".")
+        extension = file_name[dot + 1 :] if dot >= 0 else ""
+        result = cls.resolved.get(extension)
+        if result is None:
+            result = extensions.get(extension.lower(), " \uf016 ")
+            cls.resolved[extension] = result
+        return result
 
 
 class Cursor:
@@ -673,7 +810,7 @@ class Cursor:
             _ = ""
             sys.stderr.write("\x1b[6n")
             sys.stderr.flush()
-            while not (_ := _ + sys.stdin.read(1)).endswith("R"):
+            while not (_ := _ + os.read(sys.stdin.fileno(), 1).decode()).endswith("R"):
                 pass
             res = re.match(r".*\[(?P<y>\d*);(?P<x>\d*)R", _)
         finally:
@@ -683,17 +820,1586 @@ class Cursor:
         return (-1, -1)
 
 
+class DirSizer:
+    def __init__(self):
+        self.sizes = {}
+        self.partial = {}
+        self.dir_cache = Cache("dir sizes", max_entries=500_000)
+        self.pending = set()
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def request(self, path):
+        if path in self.pending:
+            return
+        self.pending.add(path)
+        self.jobs.put(path)
+
+    def worker(self):
+        while True:
+            root = self.jobs.get()
+            try:
+                self.compute(root)
+            finally:
+                self.pending.discard(root)
+
+    def size_of(self, path):
+        if path in self.sizes:
+            return self.sizes[path], True
+        if path in self.partial:
+            return self.partial[path], False
+        try:
+            stat = os.lstat(path)
+        except OSError:
+            return None, False
+        if os.path.isdir(path):
+            return None, False
+        return disk_usage(stat), True
+
+    def scan_dir(self, path):
+        try:
+            dir_stat = os.lstat(path)
+        except OSError:
+            return None
+        cached = self.dir_cache.get(path)
+        if cached and cached[0] == dir_stat.st_mtime_ns:
+            return cached
+
+        own = disk_usage(dir_stat)
+        hardlinks = []
+        subdirs = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                            continue
+                        stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if stat.st_nlink > 1:
+                        hardlinks.append((stat.st_dev, stat.st_ino, disk_usage(stat)))
+                    else:
+                        own += disk_usage(stat)
+        except OSError:
+            pass
+
+        scanned = (dir_stat.st_mtime_ns, own, tuple(hardlinks), tuple(subdirs))
+        self.dir_cache.put(path, scanned)
+        return scanned
+
+    def compute(self, root):
+        # Directory listings are reused while their mtime is unchanged, so
+        # revisiting a tree only costs one lstat per directory
+        totals = self.partial = {}
+        seen_inodes = set()
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            scanned = self.scan_dir(path)
+            if scanned is None:
+                continue
+            _, own, hardlinks, subdirs = scanned
+            for dev, ino, size in hardlinks:
+                if (dev, ino) not in seen_inodes:
+                    seen_inodes.add((dev, ino))
+                    own += size
+
+            # Roll the directory's own bytes up into every ancestor up to root
+            node = path
+            while True:
+                totals[node] = totals.get(node, 0) + own
+                if node == root or len(node) <= len(root):
+                    break
+                node = os.path.dirname(node)
+            stack.extend(subdirs)
+
+        self.sizes.update(totals)
+        self.partial = {}
+
+
+def translate_ignore_pattern(pattern):
+    anchored = "/" in pattern
+    if pattern.startswith("/"):
+        pattern = pattern[1:]
+    parts = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+            continue
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                parts.append("\\[")
+            else:
+                chars = pattern[i + 1 : end].replace("\\", "\\\\")
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                parts.append(f"[{chars}]")
+                i = end
+        elif char == "\\" and i + 1 < len(pattern):
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        else:
+            parts.append(re.escape(char))
+        i += 1
+    regex = "".join(parts)
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+    return regex
+
+
+class IgnoreRules:
+    def __init__(self, lines):
+        self.rules = []
+        for line in lines:
+            line = line.rstrip("\n")
+            if not line.endswith("\\ "):
+                line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            elif line.startswith("\\#") or line.startswith("\\!"):
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if line:
+                self.rules.append(
+                    (re.compile(translate_ignore_pattern(line)), negate, dir_only)
+                )
+
+        # Without negations the order of rules does not matter, so every rule
+        # is folded into a single alternation per entry kind
+        self.has_negations = any(negate for _, negate, _ in self.rules)
+        self.dir_regex = self.combine(self.rules)
+        self.file_regex = self.combine([rule for rule in self.rules if not rule[2]])
+
+    @staticmethod
+    def combine(rules):
+        if not rules:
+            return None
+        return re.compile("|".join(f"(?:{regex.pattern})" for regex, _, _ in rules))
+
+    @classmethod
+    def from_file(cls, path):
+        try:
+            with open(path, encoding="utf-8", errors="replace") as file:
+                return cls(file.readlines())
+        except OSError:
+            return None
+
+    def match(self, relative_path, is_dir):
+        if not self.has_negations:
+            regex = self.dir_regex if is_dir else self.file_regex
+            if regex and regex.fullmatch(relative_path):
+                return True
+            return None
+        for regex, negate, dir_only in reversed(self.rules):
+            if dir_only and not is_dir:
+                continue
+            if regex.fullmatch(relative_path):
+                return not negate
+        return None
+
+
+class IgnoreMatcher:
+    ALWAYS_IGNORED = {".git"}
+    IGNORE_FILES = (".gitignore", ".ignore")
+
+    def __init__(self):
+        self.chains = {}
+        self.mtimes = {}
+        self.global_rules = self.load_global_rules()
+
+    @staticmethod
+    def load_global_rules():
+        config_home = os.environ.get("XDG_CONFIG_HOME", os.path.expanduser("~/.config"))
+        excludes_file = os.path.join(config_home, "git", "ignore")
+        try:
+            with open(os.path.expanduser("~/.gitconfig"), encoding="utf-8") as file:
+                match = re.search(
+                    r"^\s*excludesfile\s*=\s*(.+?)\s*$", file.read(), re.I | re.M
+                )
+            if match:
+                excludes_file = os.path.expanduser(match.group(1).strip('"'))
+        except OSError:
+            pass
+        return IgnoreRules.from_file(excludes_file)
+
+    def chain_for(self, directory):
+        # Rules that apply to entries of a directory, most specific first
+        chain = self.chains.get(directory)
+        if chain is not None:
+            return chain
+
+        chain = []
+        for name in reversed(self.IGNORE_FILES):
+            rules = self.load_rules(os.path.join(directory, name))
+            if rules and rules.rules:
+                chain.append((directory, rules))
+
+        parent = os.path.dirname(directory)
+        if os.path.exists(os.path.join(directory, ".git")):
+            rules = self.load_rules(os.path.join(directory, ".git", "info", "exclude"))
+            if rules and rules.rules:
+                chain.append((directory, rules))
+            if self.global_rules and self.global_rules.rules:
+                chain.append((directory, self.global_rules))
+        elif parent != directory:
+            chain.extend(self.chain_for(parent))
+
+        self.chains[directory] = chain
+        return chain
+
+    def load_rules(self, path):
+        # Missing files are recorded too, creating one changes the rules
+        try:
+            self.mtimes[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            self.mtimes[path] = None
+            return None
+        return IgnoreRules.from_file(path)
+
+    def is_stale(self):
+        for path, mtime in list(self.mtimes.items()):
+            try:
+                current = os.stat(path).st_mtime_ns
+            except OSError:
+                current = None
+            if current != mtime:
+                return True
+        return False
+
+    def reset(self):
+        self.chains = {}
+        self.mtimes = {}
+
+    def is_ignored(self, path, is_dir):
+        directory, name = os.path.split(path)
+        if name in self.ALWAYS_IGNORED:
+            return True
+        for base, rules in self.chain_for(directory):
+            result = rules.match(os.path.relpath(path, base), is_dir)
+            if result is not None:
+                return result
+        return False
+
+
+CRAWL_BATCH_SIZE = 512
+
+
+def crawl_worker(tasks, results, follow_symlinks, respect_ignore):
+    ignore = IgnoreMatcher() if respect_ignore else None
+    entries = []
+    subdirs = []
+    finished = 0
+    while True:
+        try:
+            path = tasks.get_nowait()
+        except queue.Empty:
+            # Flush before blocking so the parent can hand out new work
+            if entries or subdirs or finished:
+                results.put((entries, subdirs, finished))
+                entries = []
+                subdirs = []
+                finished = 0
+            path = tasks.get()
+        if path is None:
+            return
+        try:
+            with os.scandir(path) as scanned:
+                for entry in scanned:
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=follow_symlinks)
+                        if ignore and ignore.is_ignored(entry.path, is_dir):
+                            continue
+                        if is_dir:
+                            stat = entry.stat(follow_symlinks=follow_symlinks)
+                            subdirs.append((entry.path, stat.st_dev, stat.st_ino))
+                    except OSError:
+                        is_dir = False
+                    entries.append((entry.path, is_dir))
+        except OSError:
+            pass
+        finished += 1
+        if len(entries) >= CRAWL_BATCH_SIZE:
+            results.put((entries, subdirs, finished))
+            entries = []
+            subdirs = []
+            finished = 0
+
+
+class ParallelCrawler:
+    def __init__(self, roots, workers=None, follow_symlinks=False, respect_ignore=True):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.workers = workers or os.cpu_count() or 1
+        self.follow_symlinks = follow_symlinks
+        self.respect_ignore = respect_ignore
+
+    def __iter__(self):
+        return self.crawl()
+
+    def crawl(self):
+        tasks = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+        seen = set()
+        outstanding = 0
+        for root in self.roots:
+            try:
+                stat = os.stat(root)
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino) in seen:
+                continue
+            seen.add((stat.st_dev, stat.st_ino))
+            tasks.put(root)
+            outstanding += 1
+        if not outstanding:
+            return
+
+        processes = [
+            multiprocessing.Process(
+                target=crawl_worker,
+                args=(tasks, results, self.follow_symlinks, self.respect_ignore),
+                daemon=True,
+            )
+            for _ in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+
+        try:
+            while outstanding:
+                entries, subdirs, finished = results.get()
+                # Directories are deduplicated by (device, inode) so symlink
+                # loops and bind mounts are only walked once
+                for path, dev, ino in subdirs:
+                    if (dev, ino) in seen:
+                        continue
+                    seen.add((dev, ino))
+                    tasks.put(path)
+                    outstanding += 1
+                outstanding -= finished
+                if entries:
+                    yield entries
+        finally:
+            for _ in processes:
+                tasks.put(None)
+            for process in processes:
+                process.join(timeout=0.1)
+                if process.is_alive():
+                    process.terminate()
+
+
+def daemon_socket_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "ftf.sock")
+    return os.path.join(tempfile.gettempdir(), f"ftf-{os.getuid()}.sock")
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.daemon.handle(json.loads(line))
+            except KeyError as error:
+                response = {"error": f"missing field {error}"}
+            except (OSError, ValueError, TypeError) as error:
+                response = {"error": str(error)}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class FtfDaemon:
+    MAX_LISTINGS = 4096
+    WATCH_INTERVAL = 1.0
+
+    def __init__(self, path=None):
+        self.path = path or daemon_socket_path()
+        self.listings = Cache("daemon listings", max_entries=self.MAX_LISTINGS)
+        self.ignore = IgnoreMatcher()
+        self.warm_queue = queue.Queue()
+
+    def handle(self, request):
+        if not isinstance(request, dict):
+            return {"error": "expected a JSON object"}
+        if request.get("op") == "ping":
+            return {"ok": True}
+        if request.get("op") == "list":
+            path = request["path"]
+            show_ignored = bool(request.get("show_ignored"))
+            names = self.list_dir(path, show_ignored)
+            # Prefetch the children so expanding them with `l` is warm too
+            for name in names:
+                self.warm_queue.put((os.path.join(path, name), show_ignored))
+            return {"names": names}
+        return {"error": f"unknown op {request.get('op')!r}"}
+
+    def read_dir(self, path, show_ignored):
+        mtime = os.stat(path).st_mtime_ns
+        names = os.listdir(path)
+        if not show_ignored:
+            names = [
+                name
+                for name in names
+                if not self.ignore.is_ignored(
+                    os.path.join(path, name), os.path.isdir(os.path.join(path, name))
+                )
+            ]
+        return mtime, names
+
+    def list_dir(self, path, show_ignored):
+        key = (path, show_ignored)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.listings.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        listing = self.listings.put(key, self.read_dir(path, show_ignored))
+        return listing[1]
+
+    def warm(self):
+        while True:
+            path, show_ignored = self.warm_queue.get()
+            if (path, show_ignored) in self.listings or not os.path.isdir(path):
+                continue
+            try:
+                self.listings.put(
+                    (path, show_ignored), self.read_dir(path, show_ignored)
+                )
+            except OSError:
+                pass
+
+    def watch(self):
+        # Poll directory mtimes and relist changed ones before they are asked for
+        while True:
+            time.sleep(self.WATCH_INTERVAL)
+            # Editing an ignore file in place leaves its folder mtime alone,
+            # so filtered listings are relisted whenever the rules change
+            rules_changed = self.ignore.is_stale()
+            if rules_changed:
+                self.ignore.reset()
+            for key, (mtime, _) in self.listings.items():
+                try:
+                    if os.stat(key[0]).st_mtime_ns == mtime and not (
+                        rules_changed and not key[1]
+                    ):
+                        continue
+                    listing = self.read_dir(*key)
+                except OSError:
+                    self.listings.invalidate(key)
+                    continue
+                self.listings.put(key, listing)
+
+    def serve(self):
+        if os.path.exists(self.path):
+            if DaemonClient.connect(self.path):
+                print(f"ftf daemon already running on {self.path}", file=sys.stderr)
+                return
+            os.unlink(self.path)
+
+        threading.Thread(target=self.warm, daemon=True).start()
+        threading.Thread(target=self.watch, daemon=True).start()
+        old_umask = os.umask(0o177)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(
+                self.path, DaemonRequestHandler
+            )
+        finally:
+            os.umask(old_umask)
+        server.daemon_threads = True
+        server.daemon = self
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(self.path)
+
+
+class DaemonClient:
+    def __init__(self, path=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(2)
+        self.sock.connect(path or daemon_socket_path())
+        self.file = self.sock.makefile("rwb")
+
+    @classmethod
+    def connect(cls, path=None):
+        try:
+            return cls(path)
+        except OSError:
+            return None
+
+    def request(self, **request):
+        self.file.write(json.dumps(request).encode() + b"\n")
+        self.file.flush()
+        return json.loads(self.file.readline())
+
+    def list_dir(self, path, show_ignored):
+        try:
+            response = self.request(op="list", path=path, show_ignored=show_ignored)
+        except (OSError, ValueError):
+            return None
+        return response.get("names")
+
+
+def natural_key(name):
+    return tuple(
+        (0, int(part)) if part.isdigit() else (1, part)
+        for part in re.split(r"(\d+)", name.lower())
+        if part
+    )
+
+
+class NodeInfo:
+    __slots__ = ("path", "name", "is_dir", "_stat", "_width", "sort_keys")
+
+    def __init__(self, path, is_dir=None):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.is_dir = os.path.isdir(path) if is_dir is None else is_dir
+        self._stat = None
+        self._width = None
+        self.sort_keys = {}
+
+    @property
+    def width(self):
+        if self._width is None:
+            self._width = display_width(self.name)
+        return self._width
+
+    @property
+    def stat(self):
+        if self._stat is None:
+            try:
+                self._stat = os.stat(self.path)
+            except OSError:
+                self._stat = False
+        return self._stat or None
+
+    @property
+    def is_link(self):
+        return os.path.islink(self.path)
+
+    @property
+    def size(self):
+        return self.stat.st_size if self.stat else 0
+
+    @property
+    def mtime(self):
+        return self.stat.st_mtime if self.stat else 0
+
+    @property
+    def extension(self):
+        _, extension = os.path.splitext(self.name)
+        return extension.lower()
+
+
+SORT_MODES = {
+    "name": lambda node: (not node.is_dir, node.name.lower()),
+    "mtime": lambda node: (not node.is_dir, -node.mtime, node.name.lower()),
+    "size": lambda node: (not node.is_dir, -node.size, node.name.lower()),
+    "extension": lambda node: (not node.is_dir, node.extension, node.name.lower()),
+    "natural": lambda node: (not node.is_dir, natural_key(node.name)),
+}
+
+
+SIZE_UNITS = {"": 1, "b": 1, "k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+TIME_UNITS = {
+    "": 1,
+    "s": 1,
+    "m": 60,
+    "h": 3600,
+    "d": 86400,
+    "w": 7 * 86400,
+    "y": 365 * 86400,
+}
+COMPARISONS = {
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "=": lambda a, b: a == b,
+}
+
+
+class FilterQuery:
+    # Cost classes: names are free, types may need an lstat, sizes and
+    # times always need a stat
+    NAME_COST = 0
+    TYPE_COST = 1
+    STAT_COST = 2
+
+    def __init__(self, text):
+        self.text = text
+        predicates = []
+        for token in text.split():
+            negate = token[0] in "!-" and len(token) > 1
+            if negate:
+                token = token[1:]
+            cost, predicate = self.compile_token(token)
+            if negate:
+                predicate = self.negated(predicate)
+            predicates.append((cost, predicate))
+        predicates.sort(key=lambda entry: entry[0])
+        self.predicates = [predicate for _, predicate in predicates]
+        self.needs_stat = any(cost == self.STAT_COST for cost, _ in predicates)
+
+    @staticmethod
+    def negated(predicate):
+        return lambda node: not predicate(node)
+
+    def compile_token(self, token):
+        match = re.fullmatch(
+            r"(size|mtime)(<=|>=|<|>|=)(\d+(?:\.\d+)?)([A-Za-z]*)", token
+        )
+        if match:
+            field, operator, number, unit = match.groups()
+            compare = COMPARISONS[operator]
+            units = SIZE_UNITS if field == "size" else TIME_UNITS
+            if unit.lower() not in units:
+                raise ValueError(f"unknown unit {unit!r} in {token!r}")
+            amount = float(number) * units[unit.lower()]
+            if field == "size":
+                return self.STAT_COST, lambda node: compare(node.size, amount)
+            # mtime compares the age of the entry, so mtime<2d means recent
+            now = time.time()
+            return self.STAT_COST, lambda node: compare(now - node.mtime, amount)
+
+        key, _, value = token.partition(":")
+        if key == "ext" and value:
+            extensions = {
+                "." + extension.lower().lstrip(".") for extension in value.split(",")
+            }
+            return self.NAME_COST, lambda node: node.extension in extensions
+        if key == "type" and value in {"f", "d", "l"}:
+            if value == "d":
+                return self.NAME_COST, lambda node: node.is_dir
+            if value == "f":
+                return self.NAME_COST, lambda node: not node.is_dir
+            return self.TYPE_COST, lambda node: node.is_link
+        if key == "name" and value:
+            return self.NAME_COST, lambda node: value.lower() in node.name.lower()
+        if ":" in token:
+            raise ValueError(f"unknown filter {token!r}")
+        # A comparison that did not parse above is a typo, not a name to match
+        if any(operator in token for operator in "<>="):
+            raise ValueError(
+                f"invalid comparison {token!r}, e.g. size>100M or mtime<2d"
+            )
+        return self.NAME_COST, lambda node: fuzzy_match(token, node.name)
+
+    def matches(self, node):
+        return all(predicate(node) for predicate in self.predicates)
+
+
+def run_filter(query_text, directories, respect_ignore=True):
+    query = FilterQuery(query_text)
+    crawler = ParallelCrawler(directories, respect_ignore=respect_ignore)
+    for batch in crawler:
+        for path, is_dir in batch:
+            if query.matches(NodeInfo(path, is_dir)):
+                print(path)
+
+
+def data_directory():
+    data_home = os.environ.get("XDG_DATA_HOME", os.path.expanduser("~/.local/share"))
+    return os.path.join(data_home, "ftf")
+
+
+class FrecencyStore:
+    COMPACT_THRESHOLD = 1000
+    MAX_ENTRIES = 5000
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(data_directory(), "history")
+        self.entries = {}
+        self.lines = 0
+        self.ranking = None
+        self.index = None
+        self.load()
+
+    def load(self):
+        # Each line is "weight<TAB>timestamp<TAB>path"; visits append a line
+        # with weight 1 and compaction folds them into one line per path
+        try:
+            with open(self.path, encoding="utf-8", errors="surrogateescape") as file:
+                for line in file:
+                    # A torn or garbled line only loses itself; it still
+                    # counts so compaction rewrites the file without it
+                    self.lines += 1
+                    try:
+                        weight, timestamp, path = line.rstrip("\n").split("\t", 2)
+                        weight, timestamp = float(weight), float(timestamp)
+                    except ValueError:
+                        continue
+                    entry = self.entries.setdefault(path, [0.0, 0.0])
+                    entry[0] += weight
+                    entry[1] = max(entry[1], timestamp)
+        except OSError:
+            pass
+
+    def add(self, directory):
+        # The file is line based, and text mode reads \r as a line break too
+        if "\n" in directory or "\r" in directory:
+            return
+        now = time.time()
+        entry = self.entries.setdefault(directory, [0.0, 0.0])
+        entry[0] += 1
+        entry[1] = now
+        self.ranking = None
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(
+                self.path, "a", encoding="utf-8", errors="surrogateescape"
+            ) as file:
+                file.write(f"1\t{now}\t{directory}\n")
+            self.lines += 1
+            if self.lines > max(self.COMPACT_THRESHOLD, 2 * len(self.entries)):
+                self.compact()
+        except OSError:
+            pass
+
+    def compact(self):
+        ranked = self.ranked()[: self.MAX_ENTRIES]
+        self.entries = {path: self.entries[path] for path in ranked}
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8", errors="surrogateescape") as file:
+            for path in ranked:
+                weight, timestamp = self.entries[path]
+                file.write(f"{weight}\t{timestamp}\t{path}\n")
+        os.replace(temporary, self.path)
+        self.lines = len(ranked)
+
+    @staticmethod
+    def score(weight, timestamp, now):
+        age = now - timestamp
+        if age < 3600:
+            return weight * 4
+        if age < 86400:
+            return weight * 2
+        if age < 7 * 86400:
+            return weight / 2
+        return weight / 4
+
+    def ranked(self):
+        if self.ranking is None:
+            now = time.time()
+            self.ranking = sorted(
+                self.entries,
+                key=lambda path: self.score(*self.entries[path], now),
+                reverse=True,
+            )
+            self.index = None
+        return self.ranking
+
+    def search(self, query):
+        ranked = self.ranked()
+        if not query:
+            return ranked
+        if self.index is None:
+            self.index = SearchIndex(ranked)
+        # The index holds paths in rank order, so matches come out ranked
+        return [ranked[index] for index in self.index.search(query)]
+
+
+def directory_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class SessionStore:
+    VERSION = 1
+
+    def __init__(self, directory, path=None):
+        # One snapshot per launch directory, so each project resumes on its own
+        key = hashlib.blake2b(
+            os.path.abspath(directory).encode("utf-8", "surrogateescape"),
+            digest_size=8,
+        ).hexdigest()
+        self.path = path or os.path.join(data_directory(), "sessions", key)
+        self.stale = collections.deque()
+        self.checking = False
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as file:
+                state = json.loads(zlib.decompress(file.read()))
+        except (OSError, ValueError, zlib.error):
+            return None
+        if not isinstance(state, dict) or state.get("version") != self.VERSION:
+            return None
+        return state
+
+    def save(self, state):
+        state["version"] = self.VERSION
+        data = zlib.compress(json.dumps(state, separators=(",", ":")).encode())
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(temporary, "wb") as file:
+                file.write(data)
+            os.replace(temporary, self.path)
+        except OSError:
+            pass
+
+    def check(self, mtimes):
+        # Compare the remaining listings against their directories off the UI
+        # thread; stale folders are queued for the UI to relist
+        self.checking = True
+        threading.Thread(target=self.check_worker, args=(mtimes,), daemon=True).start()
+
+    def check_worker(self, mtimes):
+        try:
+            for folder, mtime in mtimes.items():
+                if mtime is None or directory_mtime(folder) != mtime:
+                    self.stale.append(folder)
+        finally:
+            self.checking = False
+
+
+ARCHIVE_SUFFIXES = (
+    ".zip",
+    ".jar",
+    ".tar",
+    ".tar.gz",
+    ".tgz",
+    ".tar.bz2",
+    ".tbz2",
+    ".tar.xz",
+    ".txz",
+)
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_SUFFIXES) and os.path.isfile(path)
+
+
+class ArchiveIndex:
+    def __init__(self, path):
+        self.path = path
+        self.members = {}
+        self.children = {"": set()}
+        if zipfile.is_zipfile(path):
+            self.kind = "zip"
+            # Only the central directory is read, member data stays untouched
+            with zipfile.ZipFile(path) as archive:
+                for info in archive.infolist():
+                    self.add(info.filename, info.is_dir(), info)
+        else:
+            self.kind = "tar"
+            with tarfile.open(path) as archive:
+                for info in archive:
+                    self.add(info.name, info.isdir(), info)
+
+    def add(self, name, is_dir, info):
+        parts = [part for part in name.split("/") if part not in {"", "."}]
+        if not parts or ".." in parts:
+            return
+        name = "/".join(parts)
+        self.members[name] = (is_dir, info)
+        if is_dir:
+            self.children.setdefault(name, set())
+        parent, _, base = name.rpartition("/")
+        while True:
+            self.children.setdefault(parent, set()).add(base)
+            if parent in self.members or not parent:
+                break
+            # Archives may omit entries for intermediate directories
+            self.members[parent] = (True, None)
+            parent, _, base = parent.rpartition("/")
+
+    def is_dir(self, inner):
+        return inner == "" or self.members.get(inner, (False, None))[0]
+
+    def list_dir(self, inner):
+        return list(self.children.get(inner, ()))
+
+    def extract(self, inner, destination):
+        is_dir, _ = self.members[inner]
+        if is_dir:
+            os.makedirs(destination, exist_ok=True)
+            for name in self.list_dir(inner):
+                self.extract(f"{inner}/{name}", os.path.join(destination, name))
+            return destination
+
+        _, info = self.members[inner]
+        if self.kind == "zip":
+            with zipfile.ZipFile(self.path) as archive, archive.open(info) as source:
+                with open(destination, "wb") as target:
+                    shutil.copyfileobj(source, target)
+        else:
+            with tarfile.open(self.path) as archive:
+                source = archive.extractfile(info)
+                if source is None:
+                    return None
+                with source, open(destination, "wb") as target:
+                    shutil.copyfileobj(source, target)
+        return destination
+
+
+GREP_BATCH_SIZE = 64
+GREP_MAX_FILE_MATCHES = 100
+GREP_MAX_RESULTS = 10000
+MMAP_THRESHOLD = 1 << 20
+
+
+def grep_file(path, regex):
+    try:
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            head = file.read(8192)
+            # Treat anything with a NUL byte near the start as binary
+            if not head or b"\0" in head:
+                return []
+            if size >= MMAP_THRESHOLD:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = head + file.read()
+    except (OSError, ValueError):
+        return []
+
+    matches = []
+    line_number = 1
+    counted_to = 0
+    line_start = -1
+    try:
+        for match in regex.finditer(data):
+            start = data.rfind(b"\n", 0, match.start()) + 1
+            if start == line_start:
+                continue
+            line_start = start
+            line_number += data[counted_to:start].count(b"\n")
+            counted_to = start
+            end = data.find(b"\n", match.end())
+            if end == -1:
+                end = len(data)
+            text = data[start : min(end, start + 200)].decode("utf-8", "replace")
+            matches.append((path, line_number, text.strip()))
+            if len(matches) >= GREP_MAX_FILE_MATCHES:
+                break
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+    return matches
+
+
+def grep_files(paths, pattern, flags):
+    regex = re.compile(pattern, flags)
+    matches = []
+    for path in paths:
+        matches.extend(grep_file(path, regex))
+    return matches
+
+
+class ContentSearch:
+    def __init__(self, roots, pattern, respect_ignore=True):
+        self.roots = roots
+        self.pattern = pattern
+        self.respect_ignore = respect_ignore
+        self.results = []
+        self.files = 0
+        self.done = False
+        self.cancelled = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def compiled_pattern(self):
+        # Smart case: only case sensitive when the pattern has capitals
+        flags = 0 if any(char.isupper() for char in self.pattern) else re.IGNORECASE
+        pattern = self.pattern.encode("utf-8", "surrogateescape")
+        try:
+            re.compile(pattern, flags)
+        except re.error:
+            pattern = re.escape(pattern)
+        return pattern, flags
+
+    def add(self, future):
+        if future.cancelled() or future.exception():
+            return
+        for match in future.result():
+            if len(self.results) >= GREP_MAX_RESULTS:
+                self.cancelled = True
+                return
+            bisect.insort(self.results, match)
+
+    def run(self):
+        pattern, flags = self.compiled_pattern()
+        pool = concurrent.futures.ProcessPoolExecutor()
+        futures = set()
+        batch = []
+        try:
+            crawler = ParallelCrawler(self.roots, respect_ignore=self.respect_ignore)
+            for entries in crawler:
+                if self.cancelled:
+                    break
+                batch.extend(path for path, is_dir in entries if not is_dir)
+                while len(batch) >= GREP_BATCH_SIZE:
+                    futures.add(
+                        pool.submit(grep_files, batch[:GREP_BATCH_SIZE], pattern, flags)
+                    )
+                    self.files += GREP_BATCH_SIZE
+                    batch = batch[GREP_BATCH_SIZE:]
+                for future in [future for future in futures if future.done()]:
+                    futures.discard(future)
+                    self.add(future)
+            if batch and not self.cancelled:
+                futures.add(pool.submit(grep_files, batch, pattern, flags))
+                self.files += len(batch)
+            for future in concurrent.futures.as_completed(futures):
+                if self.cancelled:
+                    break
+                self.add(future)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.done = True
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FlatListing:
+    def __init__(self, roots, respect_ignore=True):
+        self.roots = roots
+        self.respect_ignore = respect_ignore
+        self.batches = collections.deque()
+        self.count = 0
+        self.done = False
+        self.cancelled = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            crawler = ParallelCrawler(self.roots, respect_ignore=self.respect_ignore)
+            for entries in crawler:
+                if self.cancelled:
+                    break
+                self.batches.append([path for path, _ in entries])
+                self.count += len(entries)
+        finally:
+            self.done = True
+
+    def cancel(self):
+        self.cancelled = True
+
+
+DUPLICATE_PARTIAL_BYTES = 4096
+
+
+def hash_file(path, partial):
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if partial and size > 2 * DUPLICATE_PARTIAL_BYTES:
+                digest.update(file.read(DUPLICATE_PARTIAL_BYTES))
+                file.seek(-DUPLICATE_PARTIAL_BYTES, os.SEEK_END)
+                digest.update(file.read(DUPLICATE_PARTIAL_BYTES))
+            elif partial:
+                # Both edges would cover the whole file, so hash all of it
+                digest.update(file.read())
+            else:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(chunk)
+    except OSError:
+        return path, None
+    return path, digest.hexdigest()
+
+
+class DuplicateFinder:
+    def __init__(self, roots, respect_ignore=True):
+        self.roots = roots
+        self.respect_ignore = respect_ignore
+        self.groups = []
+        self.stage = "scanning"
+        self.done = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @property
+    def reclaimable(self):
+        return sum(size * (len(paths) - 1) for size, paths in self.groups)
+
+    def run(self):
+        try:
+            groups = self.group_by_size()
+            with concurrent.futures.ProcessPoolExecutor() as pool:
+                self.stage = "hashing file edges"
+                groups = self.split_by_hash(pool, groups, partial=True)
+                # Files no bigger than both edges were already hashed whole
+                self.stage = "hashing full files"
+                small = [
+                    group for group in groups if group[0] <= 2 * DUPLICATE_PARTIAL_BYTES
+                ]
+                large = [
+                    group for group in groups if group[0] > 2 * DUPLICATE_PARTIAL_BYTES
+                ]
+                groups = small + self.split_by_hash(pool, large, partial=False)
+            self.groups = sorted((size, sorted(paths)) for size, paths in groups)
+        finally:
+            self.done = True
+
+    def group_by_size(self):
+        by_size = collections.defaultdict(list)
+        seen_inodes = set()
+        crawler = ParallelCrawler(self.roots, respect_ignore=self.respect_ignore)
+        for entries in crawler:
+            for path, is_dir in entries:
+                if is_dir:
+                    continue
+                try:
+                    file_stat = os.lstat(path)
+                except OSError:
+                    continue
+                if not stat.S_ISREG(file_stat.st_mode) or not file_stat.st_size:
+                    continue
+                # Hardlinks share their data, deleting one reclaims nothing
+                inode = (file_stat.st_dev, file_stat.st_ino)
+                if inode in seen_inodes:
+                    continue
+                seen_inodes.add(inode)
+                by_size[file_stat.st_size].append(path)
+        return [(size, paths) for size, paths in by_size.items() if len(paths) > 1]
+
+    @staticmethod
+    def split_by_hash(pool, groups, partial):
+        paths = [path for _, group in groups for path in group]
+        hashes = dict(pool.map(hash_file, paths, [partial] * len(paths), chunksize=32))
+        split = []
+        for size, group in groups:
+            by_hash = collections.defaultdict(list)
+            for path in group:
+                if hashes[path] is not None:
+                    by_hash[hashes[path]].append(path)
+            split.extend((size, paths) for paths in by_hash.values() if len(paths) > 1)
+        return split
+
+
+class DirectorySync:
+    def __init__(self, sources, destination, checksum=False):
+        self.sources = sources
+        self.destination = destination
+        self.checksum = checksum
+        self.copies = []
+        self.directories = []
+        self.links = []
+        self.stale = []
+        self.conflicts = []
+        self.unsupported = []
+        self.unchanged = 0
+        self.stage = "comparing"
+        self.done = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @property
+    def transfer_bytes(self):
+        return sum(size for _, _, size in self.copies)
+
+    def pairs(self):
+        for source in self.sources:
+            target_root = os.path.join(self.destination, os.path.basename(source))
+            if not os.path.isdir(source) or os.path.islink(source):
+                yield source, target_root
+                continue
+            for directory, dirnames, filenames in os.walk(source):
+                target = os.path.normpath(
+                    os.path.join(target_root, os.path.relpath(directory, source))
+                )
+                # A file or link where the folder should go is left alone,
+                # subtree and all
+                if os.path.islink(target) or (
+                    os.path.lexists(target) and not os.path.isdir(target)
+                ):
+                    self.conflicts.append(target)
+                    dirnames[:] = []
+                    continue
+                try:
+                    existing = set(os.listdir(target))
+                except OSError:
+                    existing = set()
+                    self.directories.append(target)
+                # Whatever the target holds beyond the source is stale
+                for name in sorted(existing - set(dirnames) - set(filenames)):
+                    self.stale.append(os.path.join(target, name))
+                # Links to folders are not walked into, run recreates them
+                links = [
+                    name
+                    for name in dirnames
+                    if os.path.islink(os.path.join(directory, name))
+                ]
+                for name in filenames + links:
+                    yield os.path.join(directory, name), os.path.join(target, name)
+
+    def run(self):
+        try:
+            suspects = []
+            for source, target in self.pairs():
+                try:
+                    source_stat = os.lstat(source)
+                    link = os.readlink(source) if os.path.islink(source) else None
+                except OSError:
+                    continue
+                try:
+                    target_stat = os.lstat(target)
+                except OSError:
+                    target_stat = None
+                if target_stat is not None and stat.S_ISDIR(target_stat.st_mode):
+                    # copy2 would drop the file inside the folder instead
+                    self.conflicts.append(target)
+                elif link is not None:
+                    # Links are recreated as links, never followed
+                    if (
+                        target_stat is not None
+                        and stat.S_ISLNK(target_stat.st_mode)
+                        and os.readlink(target) == link
+                    ):
+                        self.unchanged += 1
+                    else:
+                        self.links.append((link, target))
+                elif not stat.S_ISREG(source_stat.st_mode):
+                    self.unsupported.append(source)
+                elif (
+                    target_stat is None
+                    or stat.S_ISLNK(target_stat.st_mode)
+                    or target_stat.st_size != source_stat.st_size
+                ):
+                    self.copies.append((source, target, source_stat.st_size))
+                elif self.checksum:
+                    suspects.append((source, target, source_stat.st_size))
+                elif int(target_stat.st_mtime) != int(source_stat.st_mtime):
+                    self.copies.append((source, target, source_stat.st_size))
+                else:
+                    self.unchanged += 1
+            if suspects:
+                # Same size on both sides, only the contents can tell them apart
+                self.stage = "hashing"
+                paths = [
+                    path for source, target, _ in suspects for path in (source, target)
+                ]
+                with concurrent.futures.ProcessPoolExecutor() as pool:
+                    hashes = dict(
+                        pool.map(hash_file, paths, [False] * len(paths), chunksize=32)
+                    )
+                for source, target, size in suspects:
+                    if hashes[source] is None or hashes[source] != hashes[target]:
+                        self.copies.append((source, target, size))
+                    else:
+                        self.unchanged += 1
+        finally:
+            self.done = True
+
+    def apply(self, delete_stale):
+        for directory in self.directories:
+            os.makedirs(directory, exist_ok=True)
+        # copy2 carries the mtime over so the next sync sees these as unchanged
+        for source, target, _ in self.copies:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.islink(target):
+                os.remove(target)
+            shutil.copy2(source, target)
+        for link, target in self.links:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.lexists(target):
+                os.remove(target)
+            os.symlink(link, target)
+        copied = len(self.copies) + len(self.links)
+        if not delete_stale:
+            return copied, 0
+        for path in self.stale:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        return copied, len(self.stale)
+
+
+GIT_STATUS_COLORS = {
+    "M": "\u001b[33m",
+    "A": "\u001b[32m",
+    "R": "\u001b[34m",
+    "D": "\u001b[31m",
+    "U": "\u001b[1;31m",
+    "?": "\u001b[35m",
+    "!": "\u001b[90m",
+}
+GIT_ROLLUP_PRIORITY = "UDMRA?"
+
+
+def find_git_root(path):
+    while True:
+        if os.path.exists(os.path.join(path, ".git")):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def parse_git_status(root, output):
+    statuses = {}
+    records = iter(output.split(b"\0"))
+    for record in records:
+        if not record:
+            continue
+        line = record.decode("utf-8", "surrogateescape")
+        kind = line[0]
+        if kind in "?!":
+            statuses[line[2:].rstrip("/")] = kind
+            continue
+        if kind == "1":
+            fields = line.split(" ", 8)
+            xy, path = fields[1], fields[8]
+        elif kind == "2":
+            fields = line.split(" ", 9)
+            xy, path = fields[1], fields[9]
+            next(records, None)  # Original path of the rename
+        elif kind == "u":
+            statuses[line.split(" ", 10)[10]] = "U"
+            continue
+        else:
+            continue
+        if "D" in xy:
+            statuses[path] = "D"
+        elif kind == "2":
+            statuses[path] = "R"
+        elif xy[0] == "A":
+            statuses[path] = "A"
+        else:
+            statuses[path] = "M"
+    return {os.path.join(root, path): status for path, status in statuses.items()}
+
+
+class GitStatus:
+    POLL_INTERVAL = 1.0
+
+    def __init__(self):
+        self.root = None
+        self.statuses = {}
+        self.directories = {}
+        self.signature = None
+        self.watched_dirs = ()
+        self.refreshing = False
+        self.available = shutil.which("git") is not None
+        self.wakeup = threading.Event()
+        if self.available:
+            threading.Thread(target=self.worker, daemon=True).start()
+
+    def watch(self, directory, watched_dirs=()):
+        root = find_git_root(directory) if self.available else None
+        if root != self.root:
+            self.root = root
+            self.statuses = {}
+            self.directories = {}
+            self.signature = None
+            self.refreshing = root is not None
+        self.watched_dirs = watched_dirs
+        self.wakeup.set()
+
+    def current_signature(self, root):
+        # git status only reruns when the index or a watched directory changes
+        signature = []
+        paths = [os.path.join(root, ".git", "index"), root, *list(self.watched_dirs)]
+        for path in paths:
+            try:
+                signature.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                signature.append(None)
+        return signature
+
+    def worker(self):
+        while True:
+            self.wakeup.wait(self.POLL_INTERVAL)
+            self.wakeup.clear()
+            root = self.root
+            if root is None:
+                continue
+            signature = self.current_signature(root)
+            if signature == self.signature:
+                continue
+            self.refreshing = True
+            try:
+                output = subprocess.run(
+                    ["git", "-C", root, "status", "--porcelain=v2", "-z", "--ignored"],
+                    capture_output=True,
+                    check=True,
+                ).stdout
+            except (OSError, subprocess.CalledProcessError):
+                output = b""
+            statuses = parse_git_status(root, output)
+            if root == self.root:
+                self.statuses = statuses
+                self.directories = self.roll_up(root, statuses)
+                self.signature = signature
+            self.refreshing = False
+
+    @staticmethod
+    def roll_up(root, statuses):
+        directories = {}
+        for path, status in statuses.items():
+            if status == "!":
+                continue
+            parent = os.path.dirname(path)
+            while len(parent) >= len(root):
+                current = directories.get(parent)
+                if current and GIT_ROLLUP_PRIORITY.index(
+                    current
+                ) <= GIT_ROLLUP_PRIORITY.index(status):
+                    break
+                directories[parent] = status
+                if parent == root:
+                    break
+                parent = os.path.dirname(parent)
+        return directories
+
+    def status_of(self, path):
+        status = self.statuses.get(path) or self.directories.get(path)
+        if status or self.root is None:
+            return status
+        # Entries inside untracked or ignored directories inherit their state
+        parent = os.path.dirname(path)
+        while len(parent) > len(self.root):
+            status = self.statuses.get(parent)
+            if status in {"?", "!"}:
+                return status
+            parent = os.path.dirname(parent)
+        return None
+
+
+class RenamePlan:
+    def __init__(self, renames):
+        self.renames = [
+            (source, target) for source, target in renames if source != target
+        ]
+        self.completed = {}
+        self.validate()
+
+    def validate(self):
+        sources = {source for source, _ in self.renames}
+        targets = set()
+        for source, target in self.renames:
+            name = target[len(os.path.dirname(source)) + 1 :]
+            if name in {"", ".", ".."} or "/" in name:
+                raise ValueError(f"invalid name for {os.path.basename(source)!r}")
+            if target in targets:
+                raise ValueError(f"two entries would be renamed to {name!r}")
+            targets.add(target)
+            if os.path.lexists(target) and target not in sources:
+                raise ValueError(f"{name!r} already exists")
+
+    def execute(self):
+        sources = {source for source, _ in self.renames}
+        # Deeper entries go first so renaming a folder cannot strand its children
+        self.renames.sort(key=lambda rename: rename[0].count("/"), reverse=True)
+        # Entries whose target is another source (chains and cycles) first
+        # move to a temporary name, so no rename ever overwrites a pending one
+        # completed maps each source to where it sits on disk right now, so a
+        # failure halfway can still be mirrored in the tree
+        staged = []
+        for source, target in self.renames:
+            if target in sources:
+                temporary = os.path.join(
+                    os.path.dirname(source),
+                    f".ftf-rename-{os.getpid()}-{len(staged)}",
+                )
+                os.rename(source, temporary)
+                self.completed[source] = temporary
+                staged.append((source, temporary, target))
+            else:
+                os.rename(source, target)
+                self.completed[source] = target
+        for source, temporary, target in staged:
+            os.rename(temporary, target)
+            self.completed[source] = target
+        return self.completed
+
+
+def parse_substitution(expression):
+    # Accepts s/pattern/replacement/flags with any separator after the s
+    if len(expression) < 2 or expression[0] != "s":
+        raise ValueError("expected s/pattern/replacement/")
+    separator = expression[1]
+    parts = expression[2:].split(separator)
+    if len(parts) == 2:
+        parts.append("")
+    if len(parts) != 3:
+        raise ValueError("expected s/pattern/replacement/")
+    pattern, replacement, flags = parts
+    regex = re.compile(pattern, re.IGNORECASE if "i" in flags else 0)
+    count = 0 if "g" in flags else 1
+    return lambda name: regex.sub(replacement, name, count=count)
+
+
+EXPAND_DEPTH_LIMIT = 16
+EXPAND_ROW_BUDGET = 2000
+LISTING_CACHE_BYTES = 64 * 1024 * 1024
+
+
+def listing_size(listing):
+    path, _, names = listing
+    return (
+        sys.getsizeof(path)
+        + sys.getsizeof(names)
+        + sum(sys.getsizeof(name) for name in names)
+    )
+
+
 class FileSelector:
-    def __init__(self, directory="."):
+    def __init__(
+        self,
+        directory=".",
+        daemon=None,
+        session=None,
+        listing_budget=LISTING_CACHE_BYTES,
+        extra_roots=(),
+    ):
         self.root_directory = os.path.abspath(directory)
+        # Extra roots turn the view into a workspace with one top-level row
+        # per root, all sharing the caches and the search index below
+        self.roots = list(
+            dict.fromkeys(
+                [self.root_directory, *(os.path.abspath(root) for root in extra_roots)]
+            )
+        )
         self.tree = ["."]
-        self.expanded_folders = set()
-        self.add_items(
-            [
-                f"{self.get_absolute_path(file)}"
-                for file in os.listdir(self.root_directory)
-            ]
+        self.expanded_folders = set(self.roots) if len(self.roots) > 1 else set()
+        self.deferred_expansions = {}
+        self.daemon = daemon
+        self.session = session
+        self.nodes = Cache("nodes", max_entries=1_000_000)
+        self.listings = Cache(
+            "listings",
+            max_bytes=listing_budget,
+            sizeof=listing_size,
+            can_evict=self.listing_evictable,
         )
+        self.listing_mtimes = {}
+        self.sort_mode = "name"
+        self.archives = {}
+        self.ignore = IgnoreMatcher()
+        self.show_ignored = False
+        self.current_index = -1
         self.selected_indices = []
         self.cursor = Cursor()
         self.text_input = ""
@@ -707,9 +2413,51 @@ class FileSelector:
         self.exit_signal = False
         self.term_height = get_terminal_height()
         self.term_width = get_terminal_width()
+        signal.signal(signal.SIGWINCH, lambda *_: TERMINAL_CACHE.clear())
         self.search_query = ""
+        self.search_mode = False
+        self.search_index = None
+        self.search_index_key = None
+        self.search_rows = None
+        self.search_start_index = 0
+        self.count_prefix = ""
+        self.pending_g = False
+        self.page_size = 1
+        self.filter_mode = False
+        self.status_message = ""
+        self.jump_mode = False
+        self.jump_matches = []
+        self.jump_choice = 0
+        self.bulk_rename_mode = False
+        self.grep_mode = False
+        self.grep_view = False
+        self.grep_index = 0
+        self.content_search = None
+        self.duplicate_finder = None
+        self.flat_view = False
+        self.flat_listing = None
+        self.saved_tree = None
+        self.confirm_delete = False
+        self.sync = None
+        self.sync_delete = False
+        snapshot = (
+            self.session.load() if self.session and not self.is_workspace else None
+        )
+        if snapshot is None or not self.restore_session(snapshot):
+            self.reload_tree()
+        self.frecency = FrecencyStore()
+        self.extract_directory = None
+        self.frecency.add(self.root_directory)
+        self.search_results = []
+        self.sharded_search = None
+        self.sharded_search_key = None
         self.display_start_line = self.cursor.y  # Store the starting line for display
         self.parent_stack = []
+        self.sizer = DirSizer()
+        self.show_sizes = False
+        self.decoration_widths = Cache("row widths", max_entries=4096)
+        self.git = GitStatus()
+        self.git.watch(self.root_directory, self.expanded_folders)
 
     def arrow_indicator(self):
         if self.is_selected:
@@ -723,6 +2471,22 @@ class FileSelector:
             return "\u001b[33m*\u001b[0m "
         return ""
 
+    def size_indicator(self, item):
+        if not self.show_sizes:
+            return ""
+        path = self.root_directory if item == "." else item
+        size, complete = self.sizer.size_of(path)
+        if size is None:
+            return "\u001b[90m      - \u001b[0m"
+        if complete:
+            return f"\u001b[90m{human_size(size):>7} \u001b[0m"
+        return f"\u001b[90m{human_size(size):>6}~ \u001b[0m"
+
+    def toggle_sizes(self):
+        self.show_sizes = not self.show_sizes
+        if self.show_sizes:
+            self.sizer.request(self.root_directory)
+
     def highlight_indicator(self, string):
         if self.is_selected:
             return f"\u001b[7m{string}\u001b[0m\u001b[0m"
@@ -731,8 +2495,12 @@ class FileSelector:
     def indent(self, item, is_selected, is_picked):
         if item == ".":
             return ""
+        if self.flat_view:
+            return " "
         item_relative_path = self.get_relative_path(item)
         depth = item_relative_path.count(os.sep)
+        if self.is_workspace:
+            depth = 1 if item in self.roots else depth + 1
         if depth == 1:
             return " "
         indent_chars = "\u001b[90m" + "▏ " * (depth - 1) + "\u001b[0m"
@@ -740,16 +2508,34 @@ class FileSelector:
             return len(indent_chars[10:]) * " "
         return indent_chars.replace("▏", " ", 1)
 
+    @property
+    def is_workspace(self):
+        return len(self.roots) > 1
+
+    def root_of(self, path):
+        for root in self.roots:
+            if path == root or path.startswith(f"{root}/"):
+                return root
+        return self.root_directory
+
+    def display_path(self, path):
+        # Workspace paths keep their root's name so equal names stay apart
+        root = self.root_of(path)
+        base = os.path.dirname(root) if self.is_workspace else root
+        if path.startswith(f"{base}/"):
+            return path[len(base) + 1 :]
+        return path
+
     def change_root(self, directory):
         self.root_directory = directory
         self.tree = [self.root_directory]
         self.add_items(
-            [f"{self.get_absolute_path(file)}" for file in os.listdir(directory)]
+            [f"{self.get_absolute_path(file)}" for file in self.list_dir(directory)]
         )
         self.selected_indices = []
 
     def get_relative_path(self, item):
-        relative_path = os.path.relpath(os.path.abspath(item), self.root_directory)
+        relative_path = os.path.relpath(os.path.abspath(item), self.root_of(item))
         return f"./{relative_path}"
 
     def get_absolute_path(self, item):
@@ -768,7 +2554,22 @@ class FileSelector:
             return "\033[1;33m 󰙏 renaming \u001b[0m "
         return ""
 
+    def decoration_width(self, decoration):
+        return self.decoration_widths.get_or_compute(
+            decoration, lambda: display_width(ANSI_PATTERN.sub("", decoration))
+        )
+
+    def git_indicator(self, item):
+        if item == "." or self.git.root is None:
+            return ""
+        status = self.git.status_of(item)
+        if status is None:
+            return ""
+        return f" {GIT_STATUS_COLORS[status]}{status}\u001b[0m"
+
     def display_files(self):
+        self.term_height = get_terminal_height()
+        self.term_width = get_terminal_width()
         self.update_parent_stack()
 
         # Display parent stack
@@ -778,10 +2579,16 @@ class FileSelector:
         # Adjust display area for file list
         adjusted_start_line = self.display_start_line + len(self.parent_stack)
         terminal_height = self.term_height - len(self.parent_stack)
+        if self.deferred_expansions:
+            self.materialize_visible(terminal_height)
         page_size = min(terminal_height - adjusted_start_line - 2, len(self.tree))
 
-        start_index = max(0, self.current_index - page_size // 2)
+        # Center the cursor but keep the page full near the end of the tree
+        start_index = max(
+            0, min(self.current_index - page_size // 2, len(self.tree) - page_size)
+        )
         end_index = min(len(self.tree), start_index + page_size)
+        self.page_size = page_size
 
         if self.current_index < start_index:
             self.current_index = start_index
@@ -790,11 +2597,13 @@ class FileSelector:
 
         # Move cursor to the starting position for file list
         self.cursor.move_to(0, adjusted_start_line)
+        self.list_bottom_line = adjusted_start_line + page_size
 
+        picked = set(self.selected_indices)
         for index in range(start_index, end_index):
             item = self.tree[index]
             self.is_selected = index == self.current_index
-            self.is_picked = index in self.selected_indices
+            self.is_picked = index in picked
             self.is_marked_to_copy = item in self.marked_to_copy
             self.is_marked_to_cut = item in self.marked_to_cut
             self.is_marked_to_delete = item in self.marked_to_delete
@@ -804,12 +2613,29 @@ class FileSelector:
 
             indent = self.indent(item, self.is_selected, self.is_picked)
 
-            item_icon = NerdFontIcons.get_icon(item)
+            item_icon = NerdFontIcons.get_icon(item, self.node(item).is_dir)
 
             if item == ".":
                 basename = os.path.basename(os.path.abspath(self.root_directory))
+                if self.is_workspace:
+                    basename = f"workspace, {len(self.roots)} roots"
+                name_width = display_width(basename)
+            elif self.flat_view:
+                basename = self.display_path(item)
+                name_width = display_width(basename)
             else:
                 basename = os.path.basename(os.path.abspath(item))
+                name_width = self.node(item).width
+
+            # Clip names to the terminal so rows never wrap and shift the
+            # cursor arithmetic below
+            prefix = f"{self.arrow_indicator()}{self.size_indicator(item)}{indent}{self.pick_indicator()}"
+            suffix = f"{self.action_indicator()}{self.git_indicator(item)}"
+            available = (
+                self.term_width - 1 - self.decoration_width(prefix + item_icon + suffix)
+            )
+            if name_width > available:
+                basename = clip_middle(basename, available)
 
             display_string = item_icon + basename
 
@@ -817,8 +2643,8 @@ class FileSelector:
                 display_string = f"\u001b[9m{display_string}\u001b"
 
             if self.is_renaming:
-                display_string = (
-                    NerdFontIcons.get_icon(self.text_input) + self.text_input
+                display_string = NerdFontIcons.get_icon(self.text_input) + clip_middle(
+                    self.text_input, available
                 )
 
             print("\033[K", end="", file=sys.stderr)  # Clear the current line
@@ -828,17 +2654,17 @@ class FileSelector:
                     NerdFontIcons.get_icon(self.text_input) + self.text_input
                 )
                 print(
-                    f" {indent}{self.pick_indicator()}{display_string}",
+                    f" {self.size_indicator(item)}{indent}{self.pick_indicator()}{display_string}",
                     file=sys.stderr,
                 )
                 print(
-                    f"{self.arrow_indicator()}{indent}{self.highlight_indicator(new_file_display_string)}{self.action_indicator()}",
+                    f"{self.arrow_indicator()}{self.size_indicator(item)}{indent}{self.highlight_indicator(new_file_display_string)}{self.action_indicator()}",
                     file=sys.stderr,
                 )
                 continue
 
             print(
-                f"{self.arrow_indicator()}{indent}{self.pick_indicator()}{self.highlight_indicator(display_string)}{self.action_indicator()}",
+                f"{prefix}{self.highlight_indicator(display_string)}{suffix}",
                 file=sys.stderr,
             )
 
@@ -858,6 +2684,126 @@ class FileSelector:
         )
         self.cursor.move_to_initial_position()
 
+    def archive_index(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        cached = self.archives.get(path)
+        if cached and cached[0] == (stat.st_mtime_ns, stat.st_size):
+            return cached[1]
+        try:
+            index = ArchiveIndex(path)
+        except (OSError, tarfile.TarError, zipfile.BadZipFile):
+            return None
+        self.archives[path] = ((stat.st_mtime_ns, stat.st_size), index)
+        return index
+
+    def split_archive_path(self, path):
+        if not self.archives:
+            return None, None
+        archive = path
+        while archive and archive != os.path.dirname(archive):
+            archive = os.path.dirname(archive)
+            if archive in self.archives:
+                return self.archives[archive][1], path[len(archive) + 1 :]
+        return None, None
+
+    def is_archive_member(self, path):
+        return self.split_archive_path(path)[0] is not None
+
+    def is_expandable(self, path):
+        if path == ".":
+            return False
+        return self.node(path).is_dir or is_archive(path)
+
+    def extract_member(self, path):
+        index, inner = self.split_archive_path(path)
+        if self.extract_directory is None:
+            self.extract_directory = tempfile.mkdtemp(prefix="ftf-")
+        # Mirror the whole member path, archive included, so members sharing
+        # a basename, within one archive or across several, never collide
+        destination = os.path.join(self.extract_directory, path.lstrip("/"))
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        return index.extract(inner, destination)
+
+    def list_dir(self, path):
+        if is_archive(path):
+            index = self.archive_index(path)
+            return index.list_dir("") if index else []
+        index, inner = self.split_archive_path(path)
+        if index is not None:
+            return index.list_dir(inner)
+        # Stat before listing so a change made meanwhile makes the listing stale
+        try:
+            info = os.stat(path)
+        except OSError:
+            info = None
+        self.listing_mtimes[path] = info.st_mtime_ns if info else None
+        if info is not None:
+            # Keyed by inode so a renamed or re-rooted folder still hits
+            key = (info.st_dev, info.st_ino, self.show_ignored)
+            cached = self.listings.get(key)
+            if cached is not None and cached[1] == info.st_mtime_ns:
+                if cached[0] != path:
+                    self.listings.put(key, (path, *cached[1:]))
+                return cached[2]
+        names = self.read_dir(path)
+        if info is not None:
+            self.listings.put(key, (path, info.st_mtime_ns, tuple(names)))
+        return names
+
+    def read_dir(self, path):
+        if self.daemon:
+            names = self.daemon.list_dir(path, self.show_ignored)
+            if names is not None:
+                return names
+        names = os.listdir(path)
+        if self.show_ignored:
+            return names
+        return [
+            name
+            for name in names
+            if not self.ignore.is_ignored(
+                os.path.join(path, name), os.path.isdir(os.path.join(path, name))
+            )
+        ]
+
+    def listing_evictable(self, key, listing):
+        # Listings backing rows on screen stay, collapsed folders go first
+        path = listing[0]
+        return path != self.root_directory and path not in self.expanded_folders
+
+    def reload_tree(self):
+        current_item = self.current_item
+        self.tree = ["."]
+        if self.is_workspace:
+            self.tree.extend(self.roots)
+        else:
+            self.add_items(
+                [
+                    f"{self.get_absolute_path(item)}"
+                    for item in self.list_dir(self.root_directory)
+                ]
+            )
+        # Re-expand folders parents first so each one finds its row
+        for folder in sorted(self.expanded_folders, key=len):
+            if folder not in self.tree:
+                self.expanded_folders.discard(folder)
+                continue
+            insert_index = self.tree.index(folder) + 1
+            self.tree[insert_index:insert_index] = self.sort_tree(
+                [f"{folder}/{item}" for item in self.list_dir(folder)]
+            )
+        if current_item in self.tree:
+            self.current_index = self.tree.index(current_item)
+        else:
+            self.current_index = min(self.current_index, len(self.tree) - 1)
+
+    def toggle_ignored(self):
+        self.show_ignored = not self.show_ignored
+        self.reload_tree()
+
     def add_items(self, files):
         self.tree.extend(files)
         self.tree = list(set(self.tree))
@@ -870,12 +2816,14 @@ class FileSelector:
         else:
             self.selected_indices.append(self.current_index)
 
-    def move_cursor_up(self):
-        if self.current_index > 0:
-            self.current_index -= 1
-        self.cursor.move_up()
+    def move_cursor_up(self, lines=1):
+        # Only the index moves, display_files redraws the frame once
+        self.current_index = max(self.current_index - lines, 0)
 
     def mark_item_to_delete(self):
+        if self.is_archive_member(self.current_item):
+            self.status_message = "archive members are read-only"
+            return
         if self.current_item in self.marked_to_delete:
             self.marked_to_delete.remove(self.current_item)
             return
@@ -888,6 +2836,9 @@ class FileSelector:
         self.marked_to_copy.append(self.current_item)
 
     def mark_item_to_cut(self):
+        if self.is_archive_member(self.current_item):
+            self.status_message = "archive members are read-only"
+            return
         if self.current_item in self.marked_to_cut:
             self.marked_to_cut.remove(self.current_item)
             return
@@ -897,16 +2848,65 @@ class FileSelector:
     def current_item(self):
         return self.tree[self.current_index]
 
-    def move_cursor_down(self):
-        if self.current_index < len(self.tree) - 1:
-            self.current_index += 1
-        self.cursor.move_down()
+    def move_cursor_down(self, lines=1):
+        self.current_index = min(self.current_index + lines, len(self.tree) - 1)
+
+    def move_to_row(self, index):
+        self.current_index = min(max(index, 0), len(self.tree) - 1)
+
+    def next_sibling(self, index):
+        item = self.tree[index]
+        if item == ".":
+            return index
+        parent = os.path.dirname(item)
+        for next_index in range(index + 1, len(self.tree)):
+            candidate = self.tree[next_index]
+            if os.path.dirname(candidate) == parent:
+                return next_index
+            if not candidate.startswith(f"{parent}/"):
+                break
+        return index
+
+    def previous_sibling(self, index):
+        item = self.tree[index]
+        if item == ".":
+            return index
+        parent = os.path.dirname(item)
+        for previous_index in range(index - 1, -1, -1):
+            candidate = self.tree[previous_index]
+            if os.path.dirname(candidate) == parent:
+                return previous_index
+            if not candidate.startswith(f"{parent}/"):
+                break
+        return index
+
+    def parent_row(self, index):
+        item = self.tree[index]
+        if item == ".":
+            return index
+        parent = os.path.dirname(item)
+        for previous_index in range(index - 1, -1, -1):
+            if self.tree[previous_index] == parent:
+                return previous_index
+        return 0
+
+    def repeat_motion(self, motion, count):
+        index = self.current_index
+        for _ in range(count):
+            next_index = motion(index)
+            if next_index == index:
+                break
+            index = next_index
+        self.current_index = index
 
     def add_selected_contents(self):
         selected = self.tree[self.current_index]
         selected_path = os.path.join(self.root_directory, selected)
-        if os.path.isdir(selected_path) and selected_path not in self.expanded_folders:
-            new_files = [f"{selected}/{item}" for item in os.listdir(selected_path)]
+        if (
+            self.is_expandable(selected_path)
+            and selected_path not in self.expanded_folders
+        ):
+            new_files = [f"{selected}/{item}" for item in self.list_dir(selected_path)]
             new_files = self.sort_tree(new_files)
             insert_index = self.current_index + 1
             for file in new_files:
@@ -918,44 +2918,177 @@ class FileSelector:
         selected = self.tree[self.current_index]
         selected_path = os.path.join(self.root_directory, selected)
 
-        if os.path.isdir(selected_path):
-            self.tree = [
-                item for item in self.tree if not item.startswith(f"{selected}/")
-            ]
+        if self.is_expandable(selected_path):
+            self.collapse_rows(self.current_index)
             self.expanded_folders.discard(selected_path)
+            self.deferred_expansions.pop(selected_path, None)
+            self.listings.evict()
             self.clean_tree()
 
+    def collapse_rows(self, index):
+        # A folder's subtree is always the contiguous run of rows below it
+        prefix = f"{self.tree[index]}/"
+        end = index + 1
+        while end < len(self.tree) and self.tree[end].startswith(prefix):
+            end += 1
+        removed = self.tree[index + 1 : end]
+        del self.tree[index + 1 : end]
+        for row in removed:
+            self.expanded_folders.discard(row)
+            self.deferred_expansions.pop(row, None)
+            self.nodes.invalidate(row)
+        return removed
+
+    def expand_recursive(self, depth):
+        folder = self.current_item
+        if not self.is_expandable(folder):
+            return
+        self.collapse_rows(self.current_index)
+        self.deferred_expansions.pop(folder, None)
+        rows = self.materialize(folder, depth)
+        self.tree[self.current_index + 1 : self.current_index + 1] = rows
+        self.status_message = f"expanded {len(rows)} rows, {depth} levels deep"
+
+    def materialize(self, folder, depth):
+        # Depth first so rows come out in display order; once the budget is
+        # spent, deeper folders stay collapsed until they scroll into view
+        rows = []
+
+        def walk(folder, depth):
+            try:
+                names = self.list_dir(folder)
+            except OSError:
+                names = []
+            self.expanded_folders.add(folder)
+            for child in self.sort_tree([f"{folder}/{name}" for name in names]):
+                rows.append(child)
+                node = self.node(child)
+                if depth <= 1 or not node.is_dir or node.is_link:
+                    continue
+                if len(rows) < EXPAND_ROW_BUDGET:
+                    walk(child, depth - 1)
+                else:
+                    self.deferred_expansions[child] = depth - 1
+
+        walk(folder, depth)
+        return rows
+
+    def materialize_visible(self, window):
+        index = max(self.current_index - window, 0)
+        while index < min(self.current_index + 2 * window, len(self.tree)):
+            depth = self.deferred_expansions.pop(self.tree[index], None)
+            if depth is not None:
+                rows = self.materialize(self.tree[index], depth)
+                self.tree[index + 1 : index + 1] = rows
+                if index < self.current_index:
+                    self.current_index += len(rows)
+            index += 1
+
     def clean_tree(self):
-        self.tree = self.sort_tree(list(set(self.tree)))
+        self.tree = list(dict.fromkeys(self.tree))
+        self.resort_tree()
         self.current_index = min(self.current_index, len(self.tree) - 1)
 
     def return_dir(self):
-        self.set_root(Path(self.root_directory).parent.absolute())
+        self.set_root(os.path.dirname(self.root_directory))
 
     def delete_items(self):
+        failed = []
         for item in self.marked_to_delete:
-            if os.path.isdir(item):
+            if os.path.isdir(item) and not os.path.islink(item):
                 shutil.rmtree(item, ignore_errors=True)
-                self.tree = [x for x in self.tree if not x.startswith(item)]
             else:
-                os.remove(item)
-                self.tree.remove(item)
+                try:
+                    os.remove(item)
+                except OSError:
+                    failed.append(item)
+        # The tree kept aside by a flat view has to lose the rows too
+        deleted = set(self.marked_to_delete) - set(failed)
+        folders = tuple(f"{path}/" for path in deleted)
 
-        self.marked_to_delete = []
+        def keep(row):
+            return row not in deleted and not row.startswith(folders)
+
+        self.tree = [row for row in self.tree if keep(row)]
+        if self.saved_tree is not None:
+            tree, index = self.saved_tree
+            self.saved_tree = ([row for row in tree if keep(row)], index)
+        self.selected_indices = []
+        self.current_index = min(self.current_index, len(self.tree) - 1)
+        self.marked_to_delete = failed
+        return len(deleted)
+
+    def request_delete(self):
+        if not self.marked_to_delete:
+            self.status_message = "nothing marked to delete, d marks the current row"
+            return
+        for path in self.marked_to_delete:
+            if os.path.isdir(path) and not os.path.islink(path):
+                self.sizer.request(path)
+        self.confirm_delete = True
+
+    def marked_delete_size(self):
+        total, complete = 0, True
+        for path in self.marked_to_delete:
+            size, done = self.sizer.size_of(path)
+            total += size or 0
+            complete = complete and done
+        return total, complete
+
+    def handle_delete_key(self, char):
+        self.confirm_delete = False
+        if char == 121:  # y
+            self.status_message = f"deleted {self.delete_items()} entries"
+            if self.marked_to_delete:
+                self.status_message += (
+                    f", {len(self.marked_to_delete)} failed and stay marked"
+                )
+        elif char == 77:  # M
+            self.show_marked()
+        else:
+            self.status_message = "delete cancelled, marks kept"
+
+    def display_delete_prompt(self):
+        size, complete = self.marked_delete_size()
+        summary = f"{len(self.marked_to_delete)} entries, {human_size(size)}"
+        if not complete:
+            summary += "+"
+        self.display_prompt(
+            "Delete",
+            summary,
+            " \u001b[90my deletes, M lists them, any other key cancels\u001b[0m",
+        )
+
+    def show_marked(self):
+        if not self.marked_to_delete:
+            self.status_message = "nothing marked to delete"
+            return
+        self.show_rows(self.marked_to_delete)
+        self.status_message = (
+            f"{len(self.marked_to_delete)} marked, d unmarks, D deletes, F returns"
+        )
 
     def set_root(self, path):
         if os.path.isdir(path):
+            self.stop_flat_view()
             self.clean_display()
-            self.root_directory = Path(path).absolute()
+            self.root_directory = os.path.abspath(path)
+            self.roots = [self.root_directory]
+            self.nodes.clear()
+            self.deferred_expansions = {}
             self.tree = ["."]
             self.add_items(
                 [
                     f"{self.get_absolute_path(item)}"
-                    for item in os.listdir(self.root_directory)
+                    for item in self.list_dir(self.root_directory)
                 ]
             )
             self.selected_indices = []
             self.current_index = 1
+            self.frecency.add(self.root_directory)
+            self.git.watch(self.root_directory, self.expanded_folders)
+            if self.show_sizes:
+                self.sizer.request(self.root_directory)
 
     def exit_edit_mode(self):
         self.edit_mode = False
@@ -968,6 +3101,9 @@ class FileSelector:
         self.text_input = ""
 
     def rename_items(self):
+        if self.is_archive_member(self.current_item):
+            self.status_message = "archive members are read-only"
+            return
         if self.text_input != "":
             new_name = os.path.dirname(self.current_item) + "/" + self.text_input
             os.rename(
@@ -976,7 +3112,98 @@ class FileSelector:
             )
             self.tree[self.current_index] = new_name
 
+    def bulk_rename_targets(self):
+        indices = sorted(self.selected_indices) or [self.current_index]
+        return [
+            self.tree[index]
+            for index in indices
+            if self.tree[index] != "." and not self.is_archive_member(self.tree[index])
+        ]
+
+    def bulk_rename(self, expression):
+        items = self.bulk_rename_targets()
+        if not items:
+            return
+        plan = None
+        try:
+            if expression:
+                substitute = parse_substitution(expression)
+                names = [substitute(os.path.basename(item)) for item in items]
+            else:
+                names = self.edit_names([os.path.basename(item) for item in items])
+            plan = RenamePlan(
+                [
+                    (item, f"{os.path.dirname(item)}/{name}")
+                    for item, name in zip(items, names)
+                ]
+            )
+            renamed = plan.execute()
+        except (ValueError, re.error, OSError) as error:
+            # Whatever already moved on disk still has to move in the tree
+            if plan is not None and plan.completed:
+                self.apply_renames(plan.completed)
+            self.status_message = f"rename failed: {error}"
+            return
+        self.apply_renames(renamed)
+        self.status_message = f"renamed {len(renamed)} entries"
+
+    def edit_names(self, names):
+        editor = os.environ.get("VISUAL") or os.environ.get("EDITOR") or "vi"
+        with tempfile.NamedTemporaryFile(
+            "w+", suffix=".txt", prefix="ftf-rename-", delete=False
+        ) as file:
+            file.write("\n".join(names) + "\n")
+        try:
+            self.clean_display()
+            print("\033[?25h", end="", file=sys.stderr, flush=True)  # Show cursor
+            subprocess.call([*shlex.split(editor), file.name])
+            print("\033[?25l", end="", file=sys.stderr, flush=True)  # Hide cursor
+            self.clean_display()
+            with open(file.name) as edited:
+                new_names = edited.read().splitlines()
+        finally:
+            os.unlink(file.name)
+        while new_names and not new_names[-1]:
+            new_names.pop()
+        if len(new_names) != len(names):
+            raise ValueError(f"expected {len(names)} names, got {len(new_names)}")
+        return new_names
+
+    def apply_renames(self, renamed):
+        # Patch rows, marks and expanded folders in place instead of relisting.
+        # Targets are given under their old parent, so each path is rebuilt
+        # from its renamed ancestors down
+        resolved_folders = {}
+
+        def rename_path(path):
+            parent, name = os.path.split(path)
+            if not parent or parent == path:
+                return path
+            if path in renamed:
+                name = os.path.basename(renamed[path])
+            if parent not in resolved_folders:
+                resolved_folders[parent] = rename_path(parent)
+            return os.path.join(resolved_folders[parent], name)
+
+        self.tree = [rename_path(item) for item in self.tree]
+        for path in list(self.expanded_folders):
+            new_path = rename_path(path)
+            if new_path != path:
+                self.expanded_folders.discard(path)
+                self.expanded_folders.add(new_path)
+        for marks in (
+            self.marked_to_delete,
+            self.marked_to_copy,
+            self.marked_to_cut,
+            self.marked_as_new,
+        ):
+            marks[:] = [rename_path(path) for path in marks]
+        self.nodes.invalidate_where(lambda path: rename_path(path) != path)
+
     def add_file(self):
+        if self.is_archive_member(self.current_item):
+            self.status_message = "archive members are read-only"
+            return
         if self.text_input != "":
             if os.path.isdir(self.current_item):
                 new_path = (
@@ -995,6 +3222,9 @@ class FileSelector:
         self.current_index += 1
 
     def paste_items(self):
+        if self.is_archive_member(self.current_item):
+            self.status_message = "archive members are read-only"
+            return
         for src in self.marked_to_copy:
             if os.path.isdir(self.current_item):
                 dst = self.current_item + "/" + os.path.basename(os.path.abspath(src))
@@ -1004,7 +3234,11 @@ class FileSelector:
                     + "/"
                     + os.path.basename(os.path.abspath(src))
                 )
-            shutil.copy(src, dst)
+            if self.is_archive_member(src):
+                index, inner = self.split_archive_path(src)
+                index.extract(inner, dst)
+            else:
+                shutil.copy(src, dst)
             self.tree.insert(self.current_index + 1, dst)
             self.current_index += 1
             self.marked_as_new.append(dst)
@@ -1025,13 +3259,109 @@ class FileSelector:
             self.marked_as_new.append(dst)
         self.marked_to_copy = []
 
+    def start_sync(self, checksum=False):
+        sources = [
+            source
+            for source in self.marked_to_copy
+            if not self.is_archive_member(source)
+        ]
+        if not sources:
+            self.status_message = "mark files or folders to sync with y first"
+            return
+        if self.current_item == ".":
+            destination = self.root_directory
+        elif os.path.isdir(self.current_item):
+            destination = self.current_item
+        else:
+            destination = os.path.dirname(self.current_item)
+        if self.is_archive_member(destination):
+            self.status_message = "archive members are read-only"
+            return
+        for source in sources:
+            if destination == source or destination.startswith(f"{source}/"):
+                self.status_message = f"cannot sync {source} into itself"
+                return
+            if os.path.dirname(source) == destination:
+                self.status_message = f"{source} is already in {destination}"
+                return
+        self.sync = DirectorySync(sources, destination, checksum)
+
+    def handle_sync_key(self, char):
+        sync = self.sync
+        if char in {27, 113}:  # Escape key or q
+            self.sync = None
+        elif not sync.done:
+            return
+        elif char in {10, 13}:  # Enter key
+            self.apply_sync()
+        elif char == 100:  # d
+            self.sync_delete = not self.sync_delete
+        elif char == 99:  # c
+            self.sync = DirectorySync(
+                sync.sources, sync.destination, checksum=not sync.checksum
+            )
+
+    def apply_sync(self):
+        sync = self.sync
+        self.sync = None
+        try:
+            copied, deleted = sync.apply(self.sync_delete)
+        except OSError as error:
+            self.status_message = f"sync failed: {error}"
+        else:
+            self.status_message = (
+                f"synced {copied} entries ({human_size(sync.transfer_bytes)}),"
+                f" removed {deleted}, {sync.unchanged} unchanged"
+            )
+            if sync.conflicts:
+                self.status_message += (
+                    f", {len(sync.conflicts)} skipped where a file and a folder clash"
+                )
+            if sync.unsupported:
+                self.status_message += (
+                    f", {len(sync.unsupported)} special files skipped"
+                )
+            self.marked_to_copy = []
+        # Relist the destination and every expanded folder below it
+        for folder in sorted(self.expanded_folders | {self.root_directory}, key=len):
+            if folder == sync.destination or folder.startswith(f"{sync.destination}/"):
+                self.refresh_folder(folder)
+
+    def display_sync_plan(self):
+        sync = self.sync
+        if not sync.done:
+            self.display_prompt(
+                "Sync", f"{sync.stage}...", " \u001b[90mEsc cancels\u001b[0m"
+            )
+            return
+        stale = f"{len(sync.stale)} stale"
+        if sync.stale:
+            stale += " to delete" if self.sync_delete else " kept"
+        summary = (
+            f"{len(sync.copies)} files, {human_size(sync.transfer_bytes)} to copy,"
+            f" {sync.unchanged} unchanged, {stale}"
+        )
+        if sync.links:
+            summary += f", {len(sync.links)} links to create"
+        if sync.conflicts:
+            summary += f", {len(sync.conflicts)} file/folder conflicts skipped"
+        if sync.unsupported:
+            summary += f", {len(sync.unsupported)} special files skipped"
+        options = (
+            f" \u001b[90mEnter applies, d toggles delete,"
+            f" c {'drops' if sync.checksum else 'adds'} checksums, Esc cancels\u001b[0m"
+        )
+        self.display_prompt("Sync", summary, options)
+
     def pre_exit(self):
-        if self.mark_item_to_delete:
-            self.delete_items()
+        # Quitting never deletes; marks only go through the D confirmation
         if self.selected_file == [self.root_directory]:
             return self.selected_file
 
     def update_parent_stack(self):
+        if self.flat_view:
+            self.parent_stack = []
+            return
         current_path = self.get_relative_path(self.tree[self.current_index])
         if current_path == ".":
             self.parent_stack = []
@@ -1050,38 +3380,99 @@ class FileSelector:
     def display_parent_stack(self):
         for i, parent in enumerate(self.parent_stack):
             indent = " " * i
-            item_icon = NerdFontIcons.get_icon(
-                os.path.join(self.root_directory, parent)
-            )
+            root = self.root_of(self.current_item)
+            item_icon = NerdFontIcons.get_icon(os.path.join(root, parent))
             basename = os.path.basename(parent)
+            if parent == "." and self.is_workspace:
+                basename = os.path.basename(root)
             display_string = f"{indent}{item_icon}{basename}"
             print(f"\033[34m{display_string}\033[0m", file=sys.stderr)
 
     def run(self):
-        self.current_index = -1
         self.selected_file = []
         if len(self.tree) == 1:
             print("", file=sys.stderr)
             return
-        prev_tree = []
         while True:
-            if self.tree != prev_tree:
+            if self.grep_view:
+                self.display_grep_results()
+            else:
                 self.display_files()
-                prev_tree = self.tree.copy()
-            self.display_files()
+                self.display_status()
             if self.exit_signal:
+                self.close_sharded_search()
+                self.stop_content_search()
                 return self.pre_exit()
-            char = getch()
+            char = getch(timeout=0.05 if self.has_background_work() else None)
+            if char is None:
+                self.on_idle()
+                continue
+            self.status_message = ""
+
+            if self.grep_view and not self.edit_mode:
+                self.handle_grep_key(char)
+                continue
+
+            if self.sync is not None and not self.edit_mode:
+                self.handle_sync_key(char)
+                continue
+
+            if self.confirm_delete and not self.edit_mode:
+                self.handle_delete_key(char)
+                continue
 
             if not self.edit_mode:
+                if 49 <= char <= 57 or (char == 48 and self.count_prefix):  # 0-9
+                    self.count_prefix += chr(char)
+                    continue
+                has_count = bool(self.count_prefix)
+                count = int(self.count_prefix or 1)
+                self.count_prefix = ""
+                if self.current_index == -1 and char in {106, 4, 6, 71, 93}:
+                    self.current_index = 0
+                if self.pending_g:
+                    self.pending_g = False
+                    if char == 103:  # g
+                        self.move_to_row(count - 1 if has_count else 0)
+                    continue
+
                 if char == 106:  # j
-                    if self.current_index == -1:
-                        self.move_cursor_down()
-                    self.move_cursor_down()
+                    self.move_cursor_down(count)
                 elif char == 107:  # k
-                    self.move_cursor_up()
+                    self.move_cursor_up(count)
+                elif char == 4:  # Ctrl-d
+                    self.move_cursor_down(count * max(self.page_size // 2, 1))
+                elif char == 21:  # Ctrl-u
+                    self.move_cursor_up(count * max(self.page_size // 2, 1))
+                elif char == 6:  # Ctrl-f
+                    self.move_cursor_down(count * max(self.page_size, 1))
+                elif char == 2:  # Ctrl-b
+                    self.move_cursor_up(count * max(self.page_size, 1))
+                elif char == 103:  # g
+                    self.pending_g = True
+                    if has_count:
+                        self.count_prefix = str(count)
+                    continue
+                elif char == 71:  # G
+                    self.move_to_row(count - 1 if has_count else len(self.tree) - 1)
+                elif char == 93:  # ]
+                    self.repeat_motion(self.next_sibling, count)
+                elif char == 91:  # [
+                    self.repeat_motion(self.previous_sibling, count)
+                elif char == 45:  # -
+                    self.repeat_motion(self.parent_row, count)
+                elif self.flat_view and char in {108, 104, 69}:  # l, h or E
+                    self.status_message = "flat view, F returns to the tree"
+                elif char == 70:  # F
+                    self.toggle_flat_view()
                 elif char == 108:  # l
                     self.add_selected_contents()
+                elif char == 69:  # E
+                    self.expand_recursive(
+                        min(count, EXPAND_DEPTH_LIMIT)
+                        if has_count
+                        else EXPAND_DEPTH_LIMIT
+                    )
                 elif char == 76:  # L
                     self.set_root(self.tree[self.current_index])
                 elif char == 104:  # h
@@ -1089,13 +3480,25 @@ class FileSelector:
                 elif char == 100:  # d
                     self.mark_item_to_delete()
                 elif char == 68:  # D
-                    self.delete_items()
+                    self.request_delete()
+                elif char == 77:  # M
+                    self.show_marked()
                 elif char == 121:  # y
                     self.mark_item_to_copy()
                 elif char == 120:  # x
                     self.mark_item_to_cut()
                 elif char == 112:  # p
                     self.paste_items()
+                elif char == 80:  # P
+                    self.start_sync()
+                elif char == 82:  # R
+                    self.edit_mode = True
+                    self.bulk_rename_mode = True
+                    continue
+                elif char in {114, 97} and self.is_archive_member(
+                    self.current_item
+                ):  # r or a
+                    self.status_message = "archive members are read-only"
                 elif char == 114:  # r
                     self.text_input = os.path.basename(self.current_item)
                     self.rename_mode = True
@@ -1107,9 +3510,31 @@ class FileSelector:
                     continue
                 elif char == 72:  # H
                     self.return_dir()
+                elif char == 115:  # s
+                    self.toggle_sizes()
+                elif char == 105:  # i
+                    self.toggle_ignored()
+                elif char == 111:  # o
+                    self.cycle_sort_mode()
+                elif char == 102:  # f
+                    self.edit_mode = True
+                    self.filter_mode = True
+                    continue
+                elif char == 85:  # U
+                    self.find_duplicates()
+                elif char == 63:  # ?
+                    self.edit_mode = True
+                    self.grep_mode = True
+                    continue
+                elif char == 122:  # z
+                    self.edit_mode = True
+                    self.jump_mode = True
+                    self.update_jump()
+                    continue
                 elif char == 32:  # Spacebar
                     self.toggle_file_selection()
                 elif char == 113:  # q
+                    self.save_session()
                     self.current_index = -1
                     self.selected_file = [self.root_directory]
                     self.exit_signal = True
@@ -1118,130 +3543,702 @@ class FileSelector:
                 elif char == 47:  # /
                     self.edit_mode = True
                     self.search_mode = True
-                    self.search_mode = True
-                    self.display_search_input()
+                    # Renames and refreshes can edit rows without changing the
+                    # list or its length, so compare the rows themselves once
+                    # per search rather than once per keystroke
+                    if self.search_rows != self.tree:
+                        self.search_index = None
+                        self.close_sharded_search()
+                        self.search_rows = list(self.tree)
+                    self.search_start_index = self.current_index
                     continue
                 else:
                     pass
 
             if self.edit_mode:
                 if char in {10, 13, 27}:  # Enter key or Escape key
+                    if self.search_mode:
+                        if char == 27:  # Escape key
+                            self.current_index = self.search_start_index
+                            self.search_query = ""
+                        self.fuzzy_search()
+                    if self.filter_mode:
+                        if char != 27:  # Escape key
+                            self.apply_filter(self.text_input)
+                        self.filter_mode = False
+                    if self.bulk_rename_mode:
+                        self.bulk_rename_mode = False
+                        if char != 27:  # Escape key
+                            self.bulk_rename(self.text_input)
+                    if self.grep_mode:
+                        self.grep_mode = False
+                        if char != 27:  # Escape key
+                            self.start_content_search(self.text_input)
+                    if self.jump_mode:
+                        self.jump_mode = False
+                        if char != 27 and self.jump_matches:  # Escape key
+                            self.set_root(self.jump_matches[self.jump_choice])
                     self.exit_edit_mode()
                     continue
+                if self.jump_mode and char in {14, 16}:  # Ctrl-n or Ctrl-p
+                    step = 1 if char == 14 else -1
+                    self.jump_choice = (self.jump_choice + step) % max(
+                        len(self.jump_matches), 1
+                    )
+                    continue
                 if chr(char) in string.printable:
                     self.text_input += chr(char)
                 if char == 127:  # Backspace
                     self.text_input = self.text_input[:-1]
-                if char in {10, 13, 27}:  # Enter key or Escape key
-                    self.display_search_input()
-                    if self.search_mode:
-                        if char == 27:  # Escape key
-                            self.search_mode = False
-                            self.search_query = ""
-                        elif char in {10, 13}:  # Enter key
-                            self.fuzzy_search()
-                            self.search_mode = False
-                        elif chr(char) in string.printable:
-                            self.search_query += chr(char)
-                            self.display_search_input()
-                        elif char == 127:  # Backspace
-                            self.search_query = self.search_query[:-1]
-                            self.display_search_input()
-                            # self.exit_edit_mode()
-                            # continue
-                if chr(char) in string.printable:
-                    self.search_query += chr(char)
-                if char == 127:  # Backspace
-                    self.search_query = self.search_query[:-1]
+                if self.search_mode:
+                    self.search_query = self.text_input
+                    self.update_search()
+                if self.jump_mode:
+                    self.update_jump()
 
+        self.save_session()
+        self.close_sharded_search()
+        self.stop_content_search()
         self.selected_file = [self.tree[index] for index in self.selected_indices]
         if not self.selected_file:
             self.selected_file = [self.current_item]
+        # Archive members are streamed out one by one only when picked
+        self.selected_file = [
+            self.extract_member(item) if self.is_archive_member(item) else item
+            for item in self.selected_file
+        ]
         return self.selected_file
 
-    def sort_tree(self, paths):
-        def sort_key(path):
-            is_dir = os.path.isdir(path)
-            base_name = os.path.basename(path).lower()
-            return (not is_dir, base_name)
+    def has_background_work(self):
+        return (
+            self.search_pending()
+            or self.duplicate_finder is not None
+            or (self.show_sizes and bool(self.sizer.pending))
+            or self.git.refreshing
+            or (self.grep_view and not self.content_search.done)
+            or (self.sync is not None and not self.sync.done)
+            or (self.confirm_delete and bool(self.sizer.pending))
+            or (
+                self.flat_listing is not None
+                and (not self.flat_listing.done or bool(self.flat_listing.batches))
+            )
+            or (
+                self.session is not None
+                and (self.session.checking or bool(self.session.stale))
+            )
+        )
+
+    def on_idle(self):
+        if self.search_pending():
+            self.poll_search()
+        if self.duplicate_finder is not None:
+            self.poll_duplicates()
+        if self.flat_view:
+            self.poll_flat_view()
+        if self.session is not None:
+            while self.session.stale:
+                folder = self.session.stale.popleft()
+                if folder == self.root_directory or folder in self.expanded_folders:
+                    self.refresh_folder(folder)
+
+    def session_state(self):
+        root = self.root_directory
+
+        def relative(path):
+            return path[len(root) + 1 :] if path != root else ""
+
+        # The flat view is not persisted, the tree behind it is
+        tree = self.saved_tree[0] if self.flat_view else self.tree
+        rows = set(tree)
+        listings = {root: []}
+        for folder in self.expanded_folders:
+            if folder in rows:
+                listings[folder] = []
+        for row in tree[1:]:
+            entries = listings.get(os.path.dirname(row))
+            if entries is not None:
+                name = os.path.basename(row)
+                entries.append(f"{name}/" if self.node(row).is_dir else name)
+        cursor = None
+        if 0 <= self.current_index < len(tree) and tree[self.current_index] != ".":
+            cursor = relative(tree[self.current_index])
+        return {
+            "root": root,
+            "sort": self.sort_mode,
+            "ignored": self.show_ignored,
+            "cursor": cursor,
+            "listings": {
+                relative(folder): [self.listing_mtimes.get(folder), entries]
+                for folder, entries in listings.items()
+            },
+            "selected": (
+                [] if self.flat_view else [tree[i] for i in self.selected_indices]
+            ),
+            "copy": self.marked_to_copy,
+            "cut": self.marked_to_cut,
+        }
+
+    def save_session(self):
+        if self.session is not None and not self.is_workspace:
+            self.session.save(self.session_state())
+
+    def restore_session(self, state):
+        root = state.get("root")
+        if not isinstance(root, str) or not os.path.isdir(root):
+            return False
+        children = {}
+        mtimes = {}
+        for relative, (mtime, entries) in state.get("listings", {}).items():
+            folder = f"{root}/{relative}" if relative else root
+            children[folder] = entries
+            mtimes[folder] = mtime
+        if root not in children:
+            return False
+
+        # Rebuild rows straight from the saved listings, nothing is listed yet
+        self.root_directory = root
+        self.roots = [root]
+        self.sort_mode = (
+            state.get("sort") if state.get("sort") in SORT_MODES else "name"
+        )
+        self.show_ignored = bool(state.get("ignored"))
+        self.tree = ["."]
+        self.expanded_folders = set()
+        pending = [(root, iter(children[root]))]
+        while pending:
+            folder, entries = pending[-1]
+            entry = next(entries, None)
+            if entry is None:
+                pending.pop()
+                continue
+            is_dir = entry.endswith("/")
+            path = f"{folder}/{entry.rstrip('/')}"
+            self.nodes.put(path, NodeInfo(path, is_dir))
+            self.tree.append(path)
+            if is_dir and path in children:
+                self.expanded_folders.add(path)
+                pending.append((path, iter(children[path])))
+        self.listing_mtimes.update(mtimes)
+
+        positions = {row: index for index, row in enumerate(self.tree)}
+        cursor = state.get("cursor")
+        self.current_index = positions.get(f"{root}/{cursor}", 0) if cursor else 0
+        self.selected_indices = [
+            positions[path] for path in state.get("selected", ()) if path in positions
+        ]
+        self.marked_to_copy = [p for p in state.get("copy", ()) if os.path.lexists(p)]
+        self.marked_to_cut = [p for p in state.get("cut", ()) if os.path.lexists(p)]
+        # Delete marks never outlive the session that made them
+
+        # Only the folders feeding the rows around the cursor are checked now,
+        # the rest are compared against their mtimes in the background
+        start = max(self.current_index - self.term_height, 0)
+        window = self.tree[start : self.current_index + self.term_height]
+        visible = {root} | {os.path.dirname(row) for row in window if row != "."}
+        for folder in visible & mtimes.keys():
+            mtime = mtimes.pop(folder)
+            if mtime is None or directory_mtime(folder) != mtime:
+                self.refresh_folder(folder)
+        self.session.check(mtimes)
+        return True
+
+    def refresh_folder(self, folder):
+        if folder in self.expanded_folders and folder in self.tree:
+            start = self.tree.index(folder)
+        elif folder == self.root_directory and not self.is_workspace:
+            start = 0
+        else:
+            return
+        end = start + 1
+        while end < len(self.tree) and self.tree[end].startswith(f"{folder}/"):
+            end += 1
+        current = self.current_item if self.current_index >= 0 else None
+        selected = [self.tree[index] for index in self.selected_indices]
+
+        # Keep each surviving child together with its expanded subtree
+        groups = {}
+        child = None
+        for row in self.tree[start + 1 : end]:
+            if os.path.dirname(row) == folder:
+                child = row
+                groups[child] = [row]
+            else:
+                groups[child].append(row)
+        try:
+            names = self.list_dir(folder)
+        except OSError:
+            names = []
+        children = self.sort_tree([f"{folder}/{name}" for name in names])
+        for removed in groups.keys() - set(children):
+            for row in groups[removed]:
+                self.expanded_folders.discard(row)
+                self.nodes.invalidate(row)
+        self.tree[start + 1 : end] = [
+            row for child in children for row in groups.get(child, [child])
+        ]
+
+        positions = {row: index for index, row in enumerate(self.tree)}
+        if current is not None:
+            self.current_index = positions.get(
+                current, min(self.current_index, len(self.tree) - 1)
+            )
+        self.selected_indices = [
+            positions[path] for path in selected if path in positions
+        ]
+
+    def toggle_flat_view(self):
+        if self.flat_view:
+            self.stop_flat_view()
+            return
+        # Keep the tree aside and stream every path under the root as rows
+        self.clean_display()
+        self.saved_tree = (self.tree, self.current_index)
+        self.flat_view = True
+        self.flat_listing = FlatListing(
+            self.roots, respect_ignore=not self.show_ignored
+        )
+        self.tree = ["."]
+        self.selected_indices = []
+        self.current_index = 0
+
+    def show_rows(self, rows):
+        # A fixed list of rows in the flat view, e.g. marks or duplicates
+        self.stop_flat_view()
+        self.clean_display()
+        self.saved_tree = (self.tree, self.current_index)
+        self.flat_view = True
+        self.tree = [".", *rows]
+        self.selected_indices = []
+        self.current_index = min(1, len(self.tree) - 1)
+
+    def poll_flat_view(self):
+        # Rows only get appended, so the cursor and selection stay put
+        while self.flat_listing is not None and self.flat_listing.batches:
+            self.tree.extend(self.flat_listing.batches.popleft())
+
+    def stop_flat_view(self):
+        if not self.flat_view:
+            return
+        if self.flat_listing is not None:
+            self.flat_listing.cancel()
+        current = self.current_item
+        self.tree, self.current_index = self.saved_tree
+        if current in self.tree:
+            self.current_index = self.tree.index(current)
+        self.flat_view = False
+        self.flat_listing = None
+        self.saved_tree = None
+        self.selected_indices = []
+        self.clean_display()
+
+    def find_duplicates(self):
+        if self.duplicate_finder is None:
+            self.duplicate_finder = DuplicateFinder(
+                self.roots, respect_ignore=not self.show_ignored
+            )
+            self.poll_duplicates()
+
+    def poll_duplicates(self):
+        finder = self.duplicate_finder
+        if not finder.done:
+            self.status_message = f"Finding duplicates: {finder.stage}"
+            return
+        self.duplicate_finder = None
+        if not finder.groups:
+            self.status_message = "no duplicates found"
+            return
+        # Keep the first path of each group and mark the rest for deletion,
+        # listing every group so the marks can be reviewed before D
+        for _, paths in finder.groups:
+            for path in paths[1:]:
+                if path not in self.marked_to_delete:
+                    self.marked_to_delete.append(path)
+        self.show_rows([path for _, paths in finder.groups for path in paths])
+        self.status_message = (
+            f"{len(finder.groups)} duplicate groups,"
+            f" {human_size(finder.reclaimable)} reclaimable,"
+            f" d unmarks, D deletes, F returns"
+        )
+
+    def node(self, path):
+        node = self.nodes.get(path)
+        if node is None:
+            index, inner = self.split_archive_path(path)
+            is_dir = None if index is None else index.is_dir(inner)
+            node = self.nodes.put(path, NodeInfo(path, is_dir))
+        return node
+
+    def sort_key(self, path):
+        if path == ".":
+            return (0,)
+        node = self.node(path)
+        key = node.sort_keys.get(self.sort_mode)
+        if key is None:
+            key = node.sort_keys[self.sort_mode] = (1,) + SORT_MODES[self.sort_mode](
+                node
+            )
+        return key
 
-        sorted_paths = sorted(paths, key=sort_key)
+    def sort_tree(self, paths):
+        sorted_paths = sorted(paths, key=self.sort_key)
         return sorted_paths
 
+    def resort_tree(self):
+        # Sort each sibling group on its own and stitch the groups back
+        # together depth first, so expanded folders keep their children
+        groups = {}
+        for item in self.tree:
+            if item != ".":
+                groups.setdefault(os.path.dirname(item), []).append(item)
+        tree = ["."] if "." in self.tree else []
+        items = set(self.tree)
+        for parent in groups:
+            if parent in items:
+                continue
+            stack = [iter(self.sort_tree(groups[parent]))]
+            while stack:
+                item = next(stack[-1], None)
+                if item is None:
+                    stack.pop()
+                    continue
+                tree.append(item)
+                if item in groups:
+                    stack.append(iter(self.sort_tree(groups[item])))
+
+        current_item = self.current_item
+        selected_items = [self.tree[index] for index in self.selected_indices]
+        self.tree = tree
+        positions = {item: index for index, item in enumerate(tree)}
+        self.selected_indices = [
+            positions[item] for item in selected_items if item in positions
+        ]
+        if self.current_index >= 0 and current_item in positions:
+            self.current_index = positions[current_item]
+
+    def update_jump(self):
+        self.jump_matches = [
+            path
+            for path in self.frecency.search(self.text_input)
+            if path != self.root_directory
+        ][:1000]
+        self.jump_choice = 0
+
+    def apply_filter(self, text):
+        if not text.strip():
+            return
+        try:
+            query = FilterQuery(text)
+        except ValueError as error:
+            self.status_message = str(error)
+            return
+        # Select every row that matches so Enter outputs the whole set
+        self.selected_indices = [
+            index
+            for index, item in enumerate(self.tree)
+            if item != "." and query.matches(self.node(item))
+        ]
+        if self.selected_indices:
+            self.current_index = self.selected_indices[0]
+        self.status_message = f"{len(self.selected_indices)} matches for {text}"
+
+    def cycle_sort_mode(self):
+        modes = list(SORT_MODES)
+        self.sort_mode = modes[(modes.index(self.sort_mode) + 1) % len(modes)]
+        self.resort_tree()
+
+    def tree_search_index(self):
+        key = (id(self.tree), len(self.tree))
+        if self.search_index is None or self.search_index_key != key:
+            self.search_index = SearchIndex(
+                [os.path.basename(item) for item in self.tree]
+            )
+            self.search_index_key = key
+        return self.search_index
+
+    def tree_sharded_search(self):
+        key = (id(self.tree), len(self.tree))
+        if self.sharded_search is None or self.sharded_search_key != key:
+            self.close_sharded_search()
+            self.sharded_search = ShardedSearch(
+                [os.path.basename(item) for item in self.tree]
+            )
+            self.sharded_search_key = key
+        return self.sharded_search
+
+    def close_sharded_search(self):
+        if self.sharded_search is not None:
+            self.sharded_search.close()
+            self.sharded_search = None
+
+    def use_sharded_search(self):
+        return len(self.tree) >= SHARDED_SEARCH_THRESHOLD and (os.cpu_count() or 1) > 1
+
+    def update_search(self):
+        self.search_results = []
+        if not self.search_query:
+            return
+        if self.use_sharded_search():
+            self.tree_sharded_search().submit(self.search_query)
+            self.poll_search()
+            return
+        self.search_results = self.tree_search_index().top(self.search_query, 100)
+        if self.search_results:
+            self.current_index = self.search_results[0][1]
+
+    def poll_search(self):
+        # Show the best match among the shards that have finished so far
+        self.search_results = self.sharded_search.poll()
+        if self.search_results:
+            self.current_index = self.search_results[0][1]
+
+    def search_pending(self):
+        return (
+            self.search_mode
+            and self.sharded_search is not None
+            and bool(self.sharded_search.futures)
+        )
+
     def fuzzy_search(self):
         if self.search_query:
-            matches = []
-            for index, item in enumerate(self.tree):
-                if self.fuzzy_match(self.search_query, os.path.basename(item)):
-                    matches.append(index)
+            if self.use_sharded_search():
+                matches = self.tree_sharded_search().wait()
+            else:
+                matches = self.tree_search_index().top(self.search_query, 1)
 
             if matches:
-                self.current_index = matches[0]
+                self.current_index = matches[0][1]
                 self.expand_to_current_item()
 
         self.search_query = ""
         self.search_mode = False
 
     def fuzzy_match(self, query, text):
-        query = query.lower()
-        text = text.lower()
-        query_chars = list(query)
-        text_chars = list(text)
+        return fuzzy_match(query, text)
 
-        if len(query_chars) > len(text_chars):
-            return False
-
-        while query_chars and text_chars:
-            if query_chars[0] == text_chars[0]:
-                query_chars.pop(0)
-            text_chars.pop(0)
+    def expand_to_current_item(self, target=None):
+        if target is None:
+            target = self.tree[self.current_index]
+        root = self.root_of(target)
+        relative_path = os.path.relpath(target, root)
+        if relative_path.startswith(".."):
+            return
+        if self.is_workspace and root not in self.expanded_folders:
+            self.current_index = self.tree.index(root)
+            self.add_selected_contents()
 
-        return len(query_chars) == 0
+        # Expand each ancestor top down so the target gets a row
+        path = root
+        for part in relative_path.split(os.sep)[:-1]:
+            path = f"{path}/{part}"
+            if path not in self.tree:
+                return
+            self.current_index = self.tree.index(path)
+            self.add_selected_contents()
+        if target in self.tree:
+            self.current_index = self.tree.index(target)
 
-    def expand_to_current_item(self):
-        current_item = self.tree[self.current_index]
-        current_path = os.path.dirname(current_item)
+    def start_content_search(self, pattern):
+        self.stop_content_search()
+        if not pattern:
+            return
+        self.content_search = ContentSearch(
+            self.roots, pattern, respect_ignore=not self.show_ignored
+        )
+        self.grep_view = True
+        self.grep_index = 0
 
-        while current_path != self.root_directory:
-            self.add_selected_contents()
-            current_path = os.path.dirname(current_path)
+    def stop_content_search(self):
+        if self.content_search is not None:
+            self.content_search.cancel()
+        self.grep_view = False
 
-    def display_search_input(self):
-        # Move the cursor to the bottom of our display area
-        self.cursor.move_to(0, self.display_start_line + self.term_height - 2)
+    def handle_grep_key(self, char):
+        results = self.content_search.results
+        if char == 106:  # j
+            self.grep_index = min(self.grep_index + 1, max(len(results) - 1, 0))
+        elif char == 107:  # k
+            self.grep_index = max(self.grep_index - 1, 0)
+        elif char in {10, 13, 108}:  # Enter key or l
+            if results:
+                self.stop_content_search()
+                self.clean_display()
+                self.expand_to_current_item(results[self.grep_index][0])
+        elif char in {27, 104, 113}:  # Escape key, h or q
+            self.stop_content_search()
+            self.clean_display()
 
-        # Display the search input bar
-        print(f"\033[K\033[7m Search: {self.search_query}\033[0m", end="", flush=True)
+    def display_grep_results(self):
+        results = self.content_search.results
+        self.cursor.move_to(0, self.display_start_line)
+        page_size = self.term_height - self.display_start_line - 2
+        start_index = max(0, self.grep_index - page_size // 2)
+        for index in range(start_index, start_index + page_size):
+            if index >= len(results):
+                print("\033[K", file=sys.stderr)
+                continue
+            path, line_number, text = results[index]
+            row = f"{self.display_path(path)}:{line_number}: {text}"
+            row = row[: self.term_width - 2]
+            if index == self.grep_index:
+                print(
+                    f"\033[K\u001b[34m>\u001b[0m\u001b[7m{row}\u001b[0m",
+                    file=sys.stderr,
+                )
+            else:
+                print(f"\033[K {row}", file=sys.stderr)
+        self.list_bottom_line = self.display_start_line + page_size
 
-        # Clear the screen
-        self.clean_display()
+        search = self.content_search
+        status = f" \u001b[90m{len(results)} matches in {search.files} files"
+        if not search.done:
+            status += " (searching)"
+        self.display_prompt("Grep", search.pattern, status + "\u001b[0m")
 
-        # Calculate the middle position of the screen
-        middle_y = self.term_height // 2
-        middle_x = self.term_width // 2
+    def display_prompt(self, label, text, status=""):
+        # Draw prompts and messages on the line right below the file list
+        self.cursor.move_to(0, self.list_bottom_line)
+        print(
+            f"\033[K\033[7m {label}: {text}\033[0m{status}",
+            end="",
+            file=sys.stderr,
+            flush=True,
+        )
 
-        # Move the cursor to the middle of the screen
-        self.cursor.move_to(middle_x - 20, middle_y)
+    def display_search_input(self):
+        status = ""
+        if self.search_query:
+            status = f" \u001b[90m{len(self.search_results)} matches"
+            if self.search_pending():
+                shards = self.sharded_search
+                status += f" ({shards.finished_shards}/{len(shards.shards)} shards)"
+            status += "\u001b[0m"
+        self.display_prompt("Search", self.search_query, status)
 
-        # Display the search input bar
-        print(f"\033[7m Search: {self.search_query}\033[0m", end="", flush=True)
+    def display_status(self):
+        if self.sync is not None:
+            self.display_sync_plan()
+        elif self.confirm_delete:
+            self.display_delete_prompt()
+        elif self.search_mode:
+            self.display_search_input()
+        elif self.filter_mode:
+            self.display_prompt("Filter", self.text_input)
+        elif self.grep_mode:
+            self.display_prompt("Grep", self.text_input)
+        elif self.bulk_rename_mode:
+            count = len(self.bulk_rename_targets())
+            self.display_prompt(
+                "Rename",
+                self.text_input,
+                f" \u001b[90m{count} entries, s/pattern/replacement/ or Enter for $EDITOR\u001b[0m",
+            )
+        elif self.jump_mode:
+            status = f" \u001b[90m{len(self.jump_matches)} matches\u001b[0m"
+            if self.jump_matches:
+                status = f" {self.jump_matches[self.jump_choice]}{status}"
+            self.display_prompt("Jump", self.text_input, status)
+        else:
+            message = self.status_message
+            if self.flat_view and not message:
+                message = f"{len(self.tree) - 1} entries"
+                if self.flat_listing is not None and not self.flat_listing.done:
+                    message += f" (crawling, {self.flat_listing.count} found)"
+            self.cursor.move_to(0, self.list_bottom_line)
+            print(
+                f"\033[K\u001b[90m{message}\u001b[0m",
+                end="",
+                file=sys.stderr,
+                flush=True,
+            )
 
 
-def getch():
+def getch(timeout=None):
     fd = sys.stdin.fileno()
     old_settings = termios.tcgetattr(fd)
     try:
-        tty.setraw(fd)
-        return ord(sys.stdin.read(1))
+        # TCSANOW: the default TCSAFLUSH would drop keys already typed ahead
+        tty.setraw(fd, termios.TCSANOW)
+        if timeout is not None and not select.select([fd], [], [], timeout)[0]:
+            return None
+        # Read the fd itself: sys.stdin would buffer keys that arrived together
+        # where select cannot see them, stalling them until the next keypress
+        data = os.read(fd, 1)
+        if data and data[0] >= 0xC0:
+            data += os.read(fd, 1 if data[0] < 0xE0 else 2 if data[0] < 0xF0 else 3)
+        return ord(data.decode("utf-8", "replace")[0])
     finally:
         termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="ftf")
+    parser.add_argument(
+        "directories",
+        nargs="*",
+        metavar="directory",
+        help="one or more roots, several open a workspace",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="run the background daemon that keeps listings warm",
+    )
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="do not use a running daemon",
+    )
+    parser.add_argument(
+        "--filter",
+        metavar="QUERY",
+        help="print every path under the directories matching QUERY, e.g. 'ext:log size>100M'",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="print cache statistics to stderr on exit",
+    )
+    parser.add_argument(
+        "--session",
+        action="store_true",
+        help="save the tree on exit and resume it on the next launch here",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=LISTING_CACHE_BYTES // (1024 * 1024),
+        metavar="MB",
+        help="memory budget for cached directory listings (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="include ignored files with --filter",
+    )
+    args = parser.parse_args()
+    directories = args.directories or ["."]
+    if args.daemon:
+        FtfDaemon().serve()
+        sys.exit()
+    if args.filter is not None:
+        try:
+            run_filter(args.filter, directories, respect_ignore=not args.all)
+        except ValueError as error:
+            parser.error(str(error))
+        sys.exit()
+
     print("\033[?25l", end="", file=sys.stderr)  # Hide cursor
-    selector = FileSelector(directory=".")
+    selector = FileSelector(
+        directory=directories[0],
+        daemon=None if args.no_daemon else DaemonClient.connect(),
+        session=SessionStore(directories[0]) if args.session else None,
+        listing_budget=args.cache_size * 1024 * 1024,
+        extra_roots=directories[1:],
+    )
     selected_files = selector.run()
     print("\033[?25h", end="", file=sys.stderr)  # Show cursor
+    if args.profile:
+        print_cache_stats()
     if selected_files:
         for file in selected_files:
             print(file, end="")
@@ -0,0 +1,36 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from main import DUPLICATE_PARTIAL_BYTES, DuplicateFinder, hash_file
+
+
+def find_duplicates(root):
+    finder = DuplicateFinder([str(root)], respect_ignore=False)
+    while not finder.done:
+        time.sleep(0.01)
+    return finder.groups
+
+
+def test_files_between_one_and_two_edges_are_hashed_whole(tmp_path):
+    head = b"a" * DUPLICATE_PARTIAL_BYTES
+    (tmp_path / "first").write_bytes(head + b"x" * 2000)
+    (tmp_path / "second").write_bytes(head + b"y" * 2000)
+
+    assert (
+        hash_file(str(tmp_path / "first"), partial=True)[1]
+        != hash_file(str(tmp_path / "second"), partial=True)[1]
+    )
+    assert find_duplicates(tmp_path) == []
+
+
+def test_identical_files_are_grouped(tmp_path):
+    data = os.urandom(3 * DUPLICATE_PARTIAL_BYTES)
+    (tmp_path / "first").write_bytes(data)
+    (tmp_path / "second").write_bytes(data)
+
+    assert find_duplicates(tmp_path) == [
+        (len(data), [str(tmp_path / "first"), str(tmp_path / "second")])
+    ]